@@ -0,0 +1,8 @@
+"""Benchmarks of the hot routes against a generated database.
+
+    python -m benchmarks.run --output before.json
+    python -m benchmarks.run --output after.json
+    python -m benchmarks.compare before.json after.json
+
+See `benchmarks.generate` for the data and `benchmarks.run` for the routes.
+"""
@@ -0,0 +1,64 @@
+import argparse
+import json
+import sys
+
+
+def load(path: str) -> dict:
+    with open(path) as fd:
+        return json.load(fd)
+
+
+def compare(before: dict, after: dict, threshold: float) -> list[str]:
+    """Print a table of the changes and return the regressed scenarios.
+
+    A scenario regressed if its median got more than `threshold` percent
+    slower, or if it makes more queries than before.
+    """
+    if before["meta"]["dataset"] != after["meta"]["dataset"]:
+        print("Warning: the runs used different datasets", file=sys.stderr)
+
+    regressions = []
+    print(f"{'scenario':<30} {'before':>10} {'after':>10} {'change':>8}  queries")
+    for name, old in before["results"].items():
+        new = after["results"].get(name)
+        if new is None:
+            print(f"{name:<30} {old['median_ms']:>10.2f} {'-':>10}")
+            continue
+        change = (new["median_ms"] - old["median_ms"]) / old["median_ms"] * 100
+        flags = []
+        if change > threshold:
+            flags.append("slower")
+        if new["queries"] > old["queries"]:
+            flags.append("more queries")
+        if flags:
+            regressions.append(name)
+        print(
+            f"{name:<30} {old['median_ms']:>10.2f} {new['median_ms']:>10.2f}"
+            f" {change:>+7.1f}%  {old['queries']} -> {new['queries']}"
+            + (f"  REGRESSION ({', '.join(flags)})" if flags else "")
+        )
+    for name in after["results"].keys() - before["results"].keys():
+        print(f"{name:<30} {'-':>10} {after['results'][name]['median_ms']:>10.2f}")
+    return regressions
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark results.")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10.0,
+        help="Percent a median may grow before it counts as a regression",
+    )
+    args = parser.parse_args(argv)
+
+    regressions = compare(load(args.before), load(args.after), args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regressions", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import datetime
+import hashlib
+import io
+import os
+import random
+from dataclasses import dataclass
+
+from PIL import Image
+from werkzeug.security import generate_password_hash
+
+from receipt_helper import db
+from receipt_helper.database import rebuild_summary
+from receipt_helper.enums import ClearanceEnum, LogTypeEnum, ReceiptStatusEnum
+from receipt_helper.model.log import Log
+from receipt_helper.model.receipt import File, Receipt
+from receipt_helper.model.user import User
+from receipt_helper.storage import blob_location
+
+PASSWORD = "benchmark"
+CFO_EMAIL = "cfo@example.com"
+START = datetime.datetime(2022, 1, 1)
+DAYS = 3 * 365
+CHUNK_SIZE = 10_000
+
+ACTIVITIES = [
+    "fika",
+    "styrelsemöte",
+    "sittning",
+    "kickoff",
+    "julfest",
+    "studieresa",
+    "konferens",
+    "taxi",
+    "tågbiljett",
+    "hotell",
+    "kontorsmaterial",
+    "tryckkostnader",
+    "marknadsföring",
+    "hyra av lokal",
+    "städmaterial",
+    "porto",
+    "programvara",
+    "teknikutrustning",
+    "pubkväll",
+    "idrottsdag",
+]
+FIRST_NAMES = ["Anna", "Erik", "Maria", "Lars", "Karin", "Johan", "Sara", "Per"]
+LAST_NAMES = ["Andersson", "Johansson", "Karlsson", "Nilsson", "Eriksson", "Berg"]
+
+
+@dataclass
+class Dataset:
+    users: int = 2_000
+    receipts: int = 100_000
+    files: int = 1_000
+    """Distinct documents, receipts share them like identical uploads do."""
+    logs: int = 1_000_000
+    seed: int = 0
+
+
+def chunks(rows, size: int = CHUNK_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def insert(model, rows):
+    for batch in chunks(rows):
+        db.session.execute(db.insert(model), batch)
+    db.session.commit()
+
+
+def document(rng: random.Random) -> bytes:
+    """A small scanned looking PNG, different for every call."""
+    image = Image.new("L", (300, 400), 255)
+    pixels = image.load()
+    for _ in range(400):
+        pixels[rng.randrange(300), rng.randrange(400)] = rng.randrange(256)
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def generate(storage_path: str, dataset: Dataset) -> int:
+    """Fill the database of the current app with `dataset`.
+
+    The same dataset and seed always generate the same data. Returns the id
+    of a CFO and admin user whose password is `PASSWORD`.
+    """
+    rng = random.Random(dataset.seed)
+    password = generate_password_hash(PASSWORD)
+
+    insert(
+        User,
+        [
+            {
+                "email": CFO_EMAIL,
+                "name": "Benchmark CFO",
+                "password": password,
+                "needs_password_change": False,
+                "userTypeId": (
+                    ClearanceEnum.User | ClearanceEnum.CFO | ClearanceEnum.Admin
+                ).value,
+            }
+        ]
+        + [
+            {
+                "email": f"user{i}@example.com",
+                "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}",
+                "password": password,
+                "needs_password_change": False,
+                "userTypeId": ClearanceEnum.User.value,
+            }
+            for i in range(dataset.users)
+        ],
+    )
+    cfo_id = db.session.execute(
+        db.select(User.id).filter_by(email=CFO_EMAIL)
+    ).scalar_one()
+    user_ids = (
+        db.session.execute(db.select(User.id).where(User.id > 0).order_by(User.id))
+        .scalars()
+        .all()
+    )
+
+    files = []
+    for _ in range(dataset.files):
+        data = document(rng)
+        sha256 = hashlib.sha256(data).hexdigest()
+        path, filename = blob_location(storage_path, sha256, ".png")
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, filename), "wb") as fd:
+            fd.write(data)
+        files.append(
+            {
+                "path": path,
+                "filename": filename,
+                "sha256": sha256,
+                "mimetype": "image/png",
+                "size": len(data),
+            }
+        )
+    insert(File, files)
+    file_ids = db.session.execute(db.select(File.id).order_by(File.id)).scalars().all()
+
+    def receipts():
+        for _ in range(dataset.receipts):
+            receipt_date = START + datetime.timedelta(days=rng.randrange(DAYS))
+            submit_date = receipt_date + datetime.timedelta(days=rng.randrange(60))
+            status = rng.choices(
+                [
+                    ReceiptStatusEnum.Pending,
+                    ReceiptStatusEnum.Handled,
+                    ReceiptStatusEnum.Rejected,
+                ],
+                [2, 7, 1],
+            )[0]
+            yield {
+                "userId": rng.choice(user_ids),
+                "receipt_date": receipt_date,
+                "submit_date": submit_date,
+                "activity": f"{rng.choice(ACTIVITIES)} {receipt_date.year}",
+                "amount": rng.randrange(1_000, 500_000),
+                "statusId": status.value,
+                "statusComment": (
+                    "Kvitto saknas" if status == ReceiptStatusEnum.Rejected else None
+                ),
+                "fileId": rng.choice(file_ids),
+                "archived": status != ReceiptStatusEnum.Pending and rng.random() < 0.7,
+            }
+
+    insert(Receipt, receipts())
+    rebuild_summary()
+
+    def logs():
+        for _ in range(dataset.logs):
+            log_type = rng.choice(list(LogTypeEnum))
+            yield {
+                "datetime": START
+                + datetime.timedelta(seconds=rng.randrange(DAYS * 86400)),
+                "action": (
+                    "kvitto godkänt" if log_type == LogTypeEnum.CFO else "loggade in"
+                ),
+                "logTypeId": log_type.value,
+                "actionBy": rng.choice(user_ids),
+                "receiptId": (
+                    rng.randrange(1, dataset.receipts + 1)
+                    if log_type == LogTypeEnum.CFO
+                    else None
+                ),
+                "userId": rng.choice(user_ids) if log_type != LogTypeEnum.CFO else None,
+            }
+
+    insert(Log, logs())
+    return cfo_id
@@ -0,0 +1,305 @@
+"""Time the main pages against a generated dataset, and write the results as JSON.
+
+    python -m benchmarks.run -o after.json
+    python -m benchmarks.compare before.json after.json
+
+The dataset is generated into --data once and reused while its parameters
+stay the same. Every scenario reports its median, min and max time, its
+query count and its peak memory.
+"""
+
+import argparse
+import contextlib
+import dataclasses
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable, NamedTuple
+
+from flask import Flask
+from flask.testing import FlaskClient
+from sqlalchemy import event
+
+from benchmarks.generate import CFO_EMAIL, PASSWORD, Dataset, document, generate
+
+
+class Scenario(NamedTuple):
+    name: str
+    request: Callable[[int], object]
+    """Makes the request of the `i`:th run and returns the response."""
+
+
+def environment(data_dir: str, database: str) -> dict[str, str]:
+    return {
+        "SECRET_KEY": "benchmark",
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(data_dir, database)}",
+        "RECEIPTS_STORAGE_PATH": os.path.join(data_dir, "receipts"),
+        "RECEIPTS_ADMIN_USER_EMAIL": "admin@example.com",
+        "RECEIPTS_ADMIN_USER_NAME": "Admin",
+        "RECEIPTS_ADMIN_USER_PASSWORD": PASSWORD,
+        "RECEIPTS_EMAIL_WORKER": "none",
+        "RECEIPTS_SQLITE_MAINTENANCE_INTERVAL": "0",
+        "LOGGING_LEVEL": "30",
+    }
+
+
+def create_app(data_dir: str, database: str) -> Flask:
+    os.environ.update(environment(data_dir, database))
+    from receipt_helper import create_app
+
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    return app
+
+
+def prepare(data_dir: str, dataset: Dataset) -> None:
+    """Generate the dataset into `data_dir`, unless it is already there."""
+    marker = os.path.join(data_dir, "dataset.json")
+    if os.path.exists(marker):
+        with open(marker) as fd:
+            if json.load(fd) == dataclasses.asdict(dataset):
+                return
+    shutil.rmtree(data_dir, ignore_errors=True)
+    os.makedirs(data_dir)
+
+    app = create_app(data_dir, "template.sqlite")
+    started = time.perf_counter()
+    with app.app_context():
+        from receipt_helper import db
+
+        generate(app.config["RECEIPTS_STORAGE_PATH"], dataset)
+        with db.engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        db.engine.dispose()
+    print(
+        f"Generated {dataset} in {time.perf_counter() - started:.0f}s", file=sys.stderr
+    )
+    with open(marker, "w") as fd:
+        json.dump(dataclasses.asdict(dataset), fd)
+
+
+def login(client: FlaskClient, email: str):
+    response = client.post("/auth/login", data={"email": email, "password": PASSWORD})
+    assert response.status_code == 302, f"Login as {email} failed"
+    return response
+
+
+def scenarios(app: Flask, runs: int) -> list[Scenario]:
+    from receipt_helper import database, db
+    from receipt_helper.enums import ReceiptStatusEnum
+    from receipt_helper.model.receipt import Receipt
+    from receipt_helper.model.user import User
+
+    cfo = app.test_client()
+    login(cfo, CFO_EMAIL)
+    user = app.test_client()
+    with app.app_context():
+        user_row = db.session.execute(
+            db.select(User).filter_by(email="user1@example.com")
+        ).scalar_one()
+        user_id = user_row.id
+        login(user, user_row.email)
+        pending = (
+            db.session.execute(
+                db.select(Receipt.id)
+                .filter_by(statusId=ReceiptStatusEnum.Pending.value, archived=False)
+                .order_by(Receipt.id)
+                .limit(2 * runs)
+            )
+            .scalars()
+            .all()
+        )
+        page = database.get_all_receipts(page_size=app.config["RECEIPTS_PAGE_SIZE"])
+        for _ in range(20):
+            page = database.get_all_receipts(
+                page_size=app.config["RECEIPTS_PAGE_SIZE"], after=page.next_cursor
+            )
+        deep_cursor = page.next_cursor
+        receipt_id = db.session.execute(
+            db.select(Receipt.id)
+            .filter_by(statusId=ReceiptStatusEnum.Handled.value)
+            .order_by(Receipt.id.desc())
+            .limit(1)
+        ).scalar_one()
+    to_approve, to_reject = pending[:runs], pending[runs:]
+    upload = document(random.Random(1))
+
+    def submit(i: int):
+        return user.post(
+            "/add",
+            data={
+                "receipt_date": "2024-05-01",
+                "activity": f"benchmark {i}",
+                "amount": "125.50",
+                "user": str(user_id),
+                "file": (io.BytesIO(upload), "kvitto.png"),
+            },
+            content_type="multipart/form-data",
+        )
+
+    def export(i: int):
+        response = cfo.get(
+            "/cfo/get_receipts?receipt_date_from=2023-01-01&receipt_date_to=2023-01-31"
+        )
+        response.get_data()
+        return response
+
+    return [
+        Scenario(
+            "login",
+            lambda i: app.test_client().post(
+                "/auth/login", data={"email": CFO_EMAIL, "password": PASSWORD}
+            ),
+        ),
+        Scenario("main.index", lambda i: user.get("/")),
+        Scenario("main.search", lambda i: cfo.get("/search?q=fika")),
+        Scenario("main.view_receipt", lambda i: cfo.get(f"/receipt/{receipt_id}")),
+        Scenario(
+            "main.get_receipt_document",
+            lambda i: cfo.get(f"/receipt/{receipt_id}/receipt"),
+        ),
+        Scenario("main.add_receipt", submit),
+        Scenario("cfo.index", lambda i: cfo.get("/cfo/")),
+        Scenario("cfo.view_receipts", lambda i: cfo.get("/cfo/view_receipts")),
+        Scenario(
+            "cfo.view_receipts_deep",
+            lambda i: cfo.get(f"/cfo/view_receipts?after={deep_cursor}"),
+        ),
+        Scenario(
+            "cfo.view_archived_receipts",
+            lambda i: cfo.get("/cfo/view_archived_receipts"),
+        ),
+        Scenario(
+            "cfo.approve_receipt", lambda i: cfo.get(f"/cfo/{to_approve[i]}/approve")
+        ),
+        Scenario(
+            "cfo.reject_receipt",
+            lambda i: cfo.post(f"/cfo/{to_reject[i]}/reject", data={"reason": "Nej"}),
+        ),
+        Scenario("cfo.get_receipts", export),
+        Scenario("admin.index", lambda i: cfo.get("/admin/")),
+        Scenario(
+            "admin.index_filtered",
+            lambda i: cfo.get(f"/admin/?log_type=30&actor={user_id}"),
+        ),
+    ]
+
+
+def measure(app: Flask, scenario: Scenario, repeat: int) -> dict:
+    from receipt_helper import db
+
+    queries = 0
+
+    def count(*args):
+        nonlocal queries
+        queries += 1
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        # The first run warms caches, the last one is traced for memory, since
+        # tracing slows everything down.
+        scenario.request(0)
+        timings = []
+        for i in range(1, repeat + 1):
+            queries = 0
+            started = time.perf_counter()
+            response = scenario.request(i)
+            timings.append((time.perf_counter() - started) * 1000)
+        run_queries = queries
+
+        tracemalloc.start()
+        scenario.request(repeat + 1)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+    return {
+        "status": response.status_code,
+        "runs": repeat,
+        "median_ms": round(statistics.median(timings), 3),
+        "min_ms": round(min(timings), 3),
+        "max_ms": round(max(timings), 3),
+        "queries": run_queries,
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def metadata(dataset: Dataset, repeat: int) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "repeat": repeat,
+        "dataset": dataclasses.asdict(dataset),
+    }
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--output", "-o", help="JSON file to write, default stdout")
+    parser.add_argument("--data", default="instance/benchmark", help="Dataset folder")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--only", nargs="*", help="Scenario names to run")
+    for field in dataclasses.fields(Dataset):
+        parser.add_argument(f"--{field.name}", type=int, default=field.default)
+    args = parser.parse_args(argv)
+    dataset = Dataset(
+        **{
+            field.name: getattr(args, field.name)
+            for field in dataclasses.fields(Dataset)
+        }
+    )
+
+    prepare(args.data, dataset)
+    # Every run starts from the same data, the scenarios change it. The WAL
+    # of the previous run would be replayed into the copy and corrupt it.
+    database = os.path.join(args.data, "run.sqlite")
+    for suffix in ("-wal", "-shm"):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(database + suffix)
+    shutil.copyfile(os.path.join(args.data, "template.sqlite"), database)
+    app = create_app(args.data, "run.sqlite")
+
+    results = {}
+    for scenario in scenarios(app, args.repeat + 2):
+        if args.only and scenario.name not in args.only:
+            continue
+        results[scenario.name] = measure(app, scenario, args.repeat)
+        print(f"{scenario.name}: {results[scenario.name]}", file=sys.stderr)
+
+    output = json.dumps(
+        {"meta": metadata(dataset, args.repeat), "results": results}, indent=2
+    )
+    if args.output:
+        with open(args.output, "w") as fd:
+            fd.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,9 @@ import logging
 import os
 from logging.config import dictConfig
 
-from flask import Flask, render_template
+from flask import Flask, abort, render_template
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import make_url
 from werkzeug.exceptions import HTTPException
 
 from receipt_helper.model.model import BaseModel
@@ -14,9 +15,15 @@ db = SQLAlchemy(engine_options={"pool_pre_ping": True}, model_class=BaseModel)
 def create_app() -> Flask:
     app = Flask(__name__, instance_relative_config=True)
 
+    from .metrics import MeteredQueuePool
+    from .storage import UploadRequest
+
+    app.request_class = UploadRequest
+
     app.config.from_mapping(
         SECRET_KEY=os.getenv("SECRET_KEY"),
         SQLALCHEMY_DATABASE_URI=os.getenv("SQLALCHEMY_DATABASE_URI"),
+        SQLALCHEMY_ENGINE_OPTIONS={"poolclass": MeteredQueuePool},
         RECEIPTS_STORAGE_PATH=os.getenv(
             "RECEIPTS_STORAGE_PATH", os.path.join(app.instance_path, "receipts")
         ),
@@ -25,21 +32,108 @@ def create_app() -> Flask:
         RECEIPTS_SMTP_PORT=os.getenv("RECEIPTS_SMTP_PORT"),
         RECEIPTS_SMTP_USERNAME=os.getenv("RECEIPTS_SMTP_USERNAME"),
         RECEIPTS_SMTP_PASSWORD=os.getenv("RECEIPTS_SMTP_PASSWORD"),
+        RECEIPTS_SMTP_STARTTLS=os.getenv("RECEIPTS_SMTP_STARTTLS", "1") == "1",
+        RECEIPTS_SMTP_IDLE_TIMEOUT=float(os.getenv("RECEIPTS_SMTP_IDLE_TIMEOUT", 60)),
         RECEIPTS_ADMIN_USER_EMAIL=os.getenv("RECEIPTS_ADMIN_USER_EMAIL"),
         RECEIPTS_ADMIN_USER_NAME=os.getenv("RECEIPTS_ADMIN_USER_NAME"),
         RECEIPTS_ADMIN_USER_PASSWORD=os.getenv("RECEIPTS_ADMIN_USER_PASSWORD"),
+        MAX_CONTENT_LENGTH=int(os.getenv("RECEIPTS_MAX_UPLOAD_SIZE", 20 * 1024 * 1024))
+        or None,
+        RECEIPTS_ACCEL_REDIRECT=os.getenv("RECEIPTS_ACCEL_REDIRECT"),
+        USE_X_SENDFILE=os.getenv("RECEIPTS_X_SENDFILE", "0") == "1",
+        RECEIPTS_SQLITE_JOURNAL_MODE=os.getenv("RECEIPTS_SQLITE_JOURNAL_MODE", "WAL"),
+        RECEIPTS_SQLITE_SYNCHRONOUS=os.getenv("RECEIPTS_SQLITE_SYNCHRONOUS", "NORMAL"),
+        RECEIPTS_SQLITE_BUSY_TIMEOUT=int(
+            os.getenv("RECEIPTS_SQLITE_BUSY_TIMEOUT", 5000)
+        ),
+        RECEIPTS_SQLITE_MMAP_SIZE=int(
+            os.getenv("RECEIPTS_SQLITE_MMAP_SIZE", 256 * 1024 * 1024)
+        ),
+        RECEIPTS_SQLITE_CACHE_SIZE=int(os.getenv("RECEIPTS_SQLITE_CACHE_SIZE", -16000)),
+        RECEIPTS_SQLITE_FOREIGN_KEYS=os.getenv("RECEIPTS_SQLITE_FOREIGN_KEYS", "ON"),
+        RECEIPTS_SQLITE_TEMP_STORE=os.getenv("RECEIPTS_SQLITE_TEMP_STORE", "MEMORY"),
+        RECEIPTS_SQLITE_MAINTENANCE_INTERVAL=float(
+            os.getenv("RECEIPTS_SQLITE_MAINTENANCE_INTERVAL", 3600)
+        ),
+        RECEIPTS_SERVER_TIMING=os.getenv("RECEIPTS_SERVER_TIMING", "0") == "1",
+        RECEIPTS_SLOW_REQUEST_MS=float(os.getenv("RECEIPTS_SLOW_REQUEST_MS", 1000)),
+        RECEIPTS_METRICS_TOKEN=os.getenv("RECEIPTS_METRICS_TOKEN"),
+        RECEIPTS_BUILD_ID=os.getenv("RECEIPTS_BUILD_ID"),
+        RECEIPTS_PAGE_SIZE=int(os.getenv("RECEIPTS_PAGE_SIZE", 50)),
+        RECEIPTS_API_PAGE_SIZE=int(os.getenv("RECEIPTS_API_PAGE_SIZE", 100)),
+        RECEIPTS_SEARCH_FTS=os.getenv("RECEIPTS_SEARCH_FTS", "1") == "1",
+        RECEIPTS_USER_CACHE_SIZE=int(os.getenv("RECEIPTS_USER_CACHE_SIZE", 1024)),
+        RECEIPTS_USER_CACHE_TTL=float(os.getenv("RECEIPTS_USER_CACHE_TTL", 30)),
+        RECEIPTS_FILE_WORKERS=int(os.getenv("RECEIPTS_FILE_WORKERS", 8)),
+        RECEIPTS_PREVIEW_WORKERS=int(os.getenv("RECEIPTS_PREVIEW_WORKERS", 2)),
+        RECEIPTS_IMPORT_HASH_WORKERS=int(os.getenv("RECEIPTS_IMPORT_HASH_WORKERS", 0)),
+        RECEIPTS_EMAIL_WORKER=os.getenv("RECEIPTS_EMAIL_WORKER", "thread"),
+        RECEIPTS_EMAIL_POLL_INTERVAL=float(
+            os.getenv("RECEIPTS_EMAIL_POLL_INTERVAL", 30)
+        ),
+        RECEIPTS_EMAIL_MAX_ATTEMPTS=int(os.getenv("RECEIPTS_EMAIL_MAX_ATTEMPTS", 8)),
+        RECEIPTS_EMAIL_RETRY_DELAY=int(os.getenv("RECEIPTS_EMAIL_RETRY_DELAY", 30)),
+        RECEIPTS_EMAIL_MAX_RETRY_DELAY=int(
+            os.getenv("RECEIPTS_EMAIL_MAX_RETRY_DELAY", 3600)
+        ),
+        RECEIPTS_EMAIL_LEASE=int(os.getenv("RECEIPTS_EMAIL_LEASE", 300)),
     )
 
     app.config.from_pyfile("config.py", silent=True)
 
+    if not app.config["RECEIPTS_BUILD_ID"]:
+        from .etag import build_id
+
+        app.config["RECEIPTS_BUILD_ID"] = build_id(app.root_path)
+
     os.makedirs(app.config["RECEIPTS_STORAGE_PATH"], exist_ok=True)
     os.makedirs(app.instance_path, exist_ok=True)
 
+    # The schema migrations, the search index and the summary upserts are
+    # written for SQLite only.
+    if app.config["SQLALCHEMY_DATABASE_URI"]:
+        backend = make_url(app.config["SQLALCHEMY_DATABASE_URI"]).get_backend_name()
+        if backend != "sqlite":
+            raise RuntimeError(f"Only SQLite databases are supported, not {backend}")
+
     db.init_app(app)
 
+    from . import sqlite_profile
+
+    from . import metrics, server_timing
+
+    with app.app_context():
+        sqlite_profile.configure(app, db.engine)
+        server_timing.configure(app, db.engine)
+        metrics.configure(app, db.engine)
+
+    from .cache import user_cache
+
+    user_cache.configure(
+        app.config["RECEIPTS_USER_CACHE_SIZE"], app.config["RECEIPTS_USER_CACHE_TTL"]
+    )
+
     from . import init_data
 
-    init_data.init_db(app, db)
+    init_data.init_db(app)
+
+    from . import outbox
+
+    app.cli.add_command(outbox.cli)
+    # Not started here, since every CLI command creates the app as well.
+    app.before_request(lambda: start_background_threads(app))
+
+    from . import storage_cli
+
+    app.cli.add_command(storage_cli.cli)
+
+    from . import summary_cli
+
+    app.cli.add_command(summary_cli.cli)
+
+    from . import api_cli
+
+    app.cli.add_command(api_cli.cli)
 
     from . import auth
 
@@ -59,12 +153,27 @@ def create_app() -> Flask:
 
     app.register_blueprint(cfo.bp)
 
+    from . import api
+
+    app.register_blueprint(api.bp)
+
     app.register_error_handler(HTTPException, error_page)
 
     @app.route("/healthz")
     def healthz() -> dict[str, int]:
         return {"status": 1}
 
+    @app.route("/metrics")
+    def prometheus_metrics():
+        # Paths, timings and pool stats are not public. Without a token the
+        # metrics are not served at all.
+        token = app.config["RECEIPTS_METRICS_TOKEN"]
+        if not token:
+            abort(404)
+        if not metrics.has_bearer_token(token):
+            abort(401)
+        return metrics.export()
+
     if not app.config["TESTING"]:  # pragma: no cover
         dictConfig(
             {
@@ -104,9 +213,25 @@ def create_app() -> Flask:
             }
         )
 
+        with app.app_context():
+            app.logger.info(sqlite_profile.describe(db.engine))
         app.logger.info(f"Web app started!\t{__name__}")
     return app
 
 
+def start_background_threads(app: Flask):
+    """Start the email sender and the SQLite maintenance in this process,
+    unless already running.
+
+    Called by the first request of every process serving requests, or
+    earlier by the gunicorn config. Needs an app context.
+    """
+    from . import outbox, sqlite_profile
+
+    if app.config["RECEIPTS_EMAIL_WORKER"] == "thread":
+        outbox.start_sender_thread(app)
+    sqlite_profile.start_maintenance_thread(app, db.engine)
+
+
 def error_page(e):
     return render_template("error_page.html", e=e), e.code
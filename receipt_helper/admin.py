@@ -1,6 +1,3 @@
-import csv
-import os
-import smtplib
 from uuid import uuid4
 
 from flask import (
@@ -14,7 +11,6 @@ from flask import (
     request,
     url_for,
 )
-from werkzeug.datastructures import MultiDict
 from werkzeug.security import generate_password_hash
 
 from receipt_helper import database
@@ -28,14 +24,22 @@ from receipt_helper.database import (
     remove_user_role,
     reset_user_password,
 )
-from receipt_helper.enums import ClearanceEnum, LogTypeEnum
+from receipt_helper.enums import (
+    EMAIL_STATUS_COLOR_MAP,
+    ClearanceEnum,
+    EmailStatusEnum,
+    LogTypeEnum,
+)
+from receipt_helper.etag import cached_by_changes
+from receipt_helper.forms.log_forms import LogFilterForm
 from receipt_helper.forms.user_forms import (
     AddManyUsersForm,
     AddSingleUserForm,
     UpdateUserForm,
 )
 from receipt_helper.model.user import User
-from receipt_helper.util import send_email
+from receipt_helper.outbox import queue_email
+from receipt_helper.user_import import account_created_email, import_users, read_rows
 
 bp = Blueprint("admin", __name__, url_prefix="/admin")
 
@@ -44,18 +48,67 @@ bp = Blueprint("admin", __name__, url_prefix="/admin")
 @login_required
 @admin_required
 def index():
-    logs = get_logs()
-    return render_template("admin/index.html", logs=logs)
+    form = LogFilterForm(request.args)
+    users = [("", "Alla")] + [(user.id, user.name) for user in get_users()]
+    form.actor.choices = users
+    form.user.choices = users
+
+    filters = {}
+    if form.validate():
+        filters = dict(
+            log_type=form.log_type.data,
+            action_by=form.actor.data,
+            receipt=form.receipt.data,
+            user=form.user.data,
+            date_from=form.date_from.data,
+            date_to=form.date_to.data,
+        )
+
+    try:
+        page = get_logs(
+            **filters,
+            page_size=current_app.config["RECEIPTS_PAGE_SIZE"],
+            after=request.args.get("after"),
+            before=request.args.get("before"),
+        )
+    except ValueError:
+        abort(400, "Ogiltig sida!")
+    return render_template("admin/index.html", logs=page.items, page=page, form=form)
 
 
 @bp.route("/list_users")
 @login_required
 @admin_required
+@cached_by_changes(database.get_latest_login)
 def list_users():
     users = get_users()
     return render_template("admin/list_users.html", users=users)
 
 
+@bp.route("/emails")
+@login_required
+@admin_required
+def list_emails():
+    status = request.args.get("status", type=int)
+    try:
+        page = database.get_emails(
+            status=status,
+            page_size=current_app.config["RECEIPTS_PAGE_SIZE"],
+            after=request.args.get("after"),
+            before=request.args.get("before"),
+        )
+    except ValueError:
+        abort(400, "Ogiltig sida!")
+    return render_template(
+        "admin/list_emails.html",
+        emails=page.items,
+        page=page,
+        status=status,
+        EmailStatusEnum=EmailStatusEnum,
+        EMAIL_STATUS_COLOR_MAP=EMAIL_STATUS_COLOR_MAP,
+    )
+
+
 @bp.route("/add_single_user", methods=("GET", "POST"))
 @login_required
 @admin_required
@@ -88,26 +141,7 @@ def add_user(name: str, email: str) -> bool:
 
     log_action(f"användare tillagd", LogTypeEnum.Admin, g.user.id, user=user.id)
 
-    try:
-        send_email(
-            email,
-            "Konto för kvittoredovisning skapat!",
-            f"""Hej
-
-Det har skapats ett konto åt dig för att kunna hantera kvittoredovisningar. Inloggningsuppgifter står nedan.
-
-Länk: {url_for('main.index', _external=True)}
-Användarnamn: {email}
-Lösenord: {temp_password}
-
-Ovanstående lösenord är temporärt och vid första inloggning kommer du behöva byta ditt lösenord.
-""",
-        )
-    except smtplib.SMTPException:
-        flash(
-            f"Fel vid skickande av email till {name}, nollställ användarens lösenord för att skicka ett nytt mejl."
-        )
-        return False
+    queue_email(*account_created_email(email, temp_password))
     return True
 
 
@@ -119,26 +153,12 @@ def add_many_users():
     if request.method != "POST" or not form.validate_on_submit():
         return render_template("admin/add_many_users.html", form=form)
 
-    file = form.file.data
-    filepath = os.path.join(current_app.instance_path, "import.csv")
-    file.save(filepath)
-    with open(filepath) as fd:
-        reader = csv.DictReader(fd, fieldnames=["name", "email"])
-
-        added_users = 0
-        for row in reader:
-            m_dict_row = MultiDict(row)
-            user_form = AddSingleUserForm(m_dict_row, meta={"csrf": False})
-            if not user_form.validate():
-                for error in user_form.errors:
-                    flash(f"Felaktig data för användare {row}: {error}")
-                continue
-            name = user_form.name.data
-            email = user_form.email.data
-            if add_user(name, email):
-                added_users += 1
+    rows = read_rows(form.file.data.stream)
+    if not import_users(rows, g.user.id):
+        flash("Fel vid skapandet av kontona, inga användare lades till!")
+    added_users = sum(row.added for row in rows)
     flash(f"Lade till {added_users} användare!")
-    return redirect(url_for("admin.index"))
+    return render_template("admin/import_report.html", rows=rows)
 
 
 @bp.route("/<int:id>/update", methods=("GET", "POST"))
@@ -183,11 +203,10 @@ def reset_password(id: int):
 
     log_action(f"lösenord nollställt", LogTypeEnum.Admin, g.user.id, user=user.id)
 
-    try:
-        send_email(
-            email,
-            "Lösenord för kvittoredovisning nollställt!",
-            f"""Hej
+    queue_email(
+        email,
+        "Lösenord för kvittoredovisning nollställt!",
+        f"""Hej
             
 Ditt lösenord för kvittoredovisningar har nollställts. Ditt temporära lösenord anges nedan.
 
@@ -196,13 +215,8 @@ Länk: {url_for('main.index', _external=True)}
 
 Ovanstående lösenord är temporärt och vid första inloggning kommer du behöva byta ditt lösenord.
 """,
-        )
-        flash(f"Lösenord nollställt för {user.name}")
-    except smtplib.SMTPException:
-        flash(
-            f"Fel vid skickande av email till {user.name}, nollställ användarens lösenord för att skicka ett nytt mejl, eller kontakta en administratör."
-        )
-        return redirect(url_for("admin.list_users"))
+    )
+    flash(f"Lösenord nollställt för {user.name}")
     return redirect(url_for("admin.list_users"))
 
 
@@ -268,10 +282,9 @@ def delete_user(id: int):
         flash("Du kan inte radera dig själv!")
         return redirect(url_for("admin.list_users"))
 
-    if not database.delete_user(id):
+    if not database.delete_user(id, g.user.id):
         flash("Användare hittades inte!")
         return redirect(url_for("admin.list_users"))
-    log_action(f"användare raderad", LogTypeEnum.Admin, g.user.id, user=id)
     return redirect(url_for("admin.list_users"))
 
 
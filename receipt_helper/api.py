@@ -0,0 +1,162 @@
+import datetime
+import hashlib
+
+from flask import Blueprint, Response, abort, current_app, g, jsonify, request
+from sqlalchemy.orm import InstrumentedAttribute
+from werkzeug.exceptions import HTTPException
+
+from receipt_helper import database
+from receipt_helper.model.log import Log
+from receipt_helper.model.receipt import Receipt
+from receipt_helper.model.user import User
+
+bp = Blueprint("api", __name__, url_prefix="/api/v1")
+
+MAX_LIMIT = 1000
+
+RECEIPT_FIELDS = {
+    c.key: c
+    for c in (
+        Receipt.id,
+        Receipt.userId,
+        Receipt.receipt_date,
+        Receipt.submit_date,
+        Receipt.activity,
+        Receipt.amount,
+        Receipt.statusId,
+        Receipt.statusComment,
+        Receipt.fileId,
+        Receipt.archived,
+        Receipt.version,
+        Receipt.updated,
+    )
+}
+# Password hashes never leave the database.
+USER_FIELDS = {
+    c.key: c
+    for c in (
+        User.id,
+        User.email,
+        User.name,
+        User.userTypeId,
+        User.lastLogin,
+        User.updated,
+    )
+}
+LOG_FIELDS = {
+    c.key: c
+    for c in (
+        Log.id,
+        Log.datetime,
+        Log.logTypeId,
+        Log.actionBy,
+        Log.receiptId,
+        Log.userId,
+        Log.action,
+    )
+}
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+@bp.before_request
+def authenticate():
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        abort(401, "Bearer-token saknas!")
+    g.api_token = database.get_api_token(hash_token(token.strip()))
+    if g.api_token is None:
+        abort(401, "Ogiltig token!")
+
+
+@bp.errorhandler(HTTPException)
+def error(e: HTTPException) -> Response:
+    response = jsonify(error=e.description)
+    response.status_code = e.code
+    if e.code == 401:
+        response.headers["WWW-Authenticate"] = "Bearer"
+    return response
+
+
+@bp.route("/receipts")
+def receipts():
+    """Receipts by when they last changed, see `list_rows`."""
+    return list_rows(RECEIPT_FIELDS, (Receipt.updated, Receipt.id))
+
+
+@bp.route("/users")
+def users():
+    """Users by when they last changed, see `list_rows`."""
+    return list_rows(USER_FIELDS, (User.updated, User.id), User.id > 0)
+
+
+@bp.route("/logs")
+def logs():
+    """Log entries by when they were made, see `list_rows`."""
+    return list_rows(LOG_FIELDS, (Log.datetime, Log.id))
+
+
+def list_rows(
+    fields: dict[str, InstrumentedAttribute],
+    order: tuple[InstrumentedAttribute, ...],
+    *where,
+) -> dict:
+    """A page of rows as `{"items": [...], "next_cursor": ...}`.
+
+    Takes the query parameters `fields`, a comma separated subset of `fields`
+    to select instead of all of them, `updated_since`, an ISO 8601 timestamp
+    the first column of `order` must be at or after, `after`, the
+    `next_cursor` of the previous page, and `limit`, the page size.
+    Only the requested columns are queried, and the rows are serialized
+    straight from the result without loading any models.
+    """
+    names = list(fields)
+    if request.args.get("fields"):
+        names = request.args["fields"].split(",")
+        unknown = [name for name in names if name not in fields]
+        if unknown:
+            abort(400, f"Okända fält: {', '.join(unknown)}")
+
+    since = request.args.get("updated_since")
+    if since is not None:
+        try:
+            since = datetime.datetime.fromisoformat(since)
+        except ValueError:
+            abort(400, "Ogiltig tidpunkt!")
+        if since.tzinfo is not None:
+            # Timestamps are stored as naive UTC.
+            since = since.astimezone(datetime.UTC).replace(tzinfo=None)
+
+    limit = request.args.get(
+        "limit", current_app.config["RECEIPTS_API_PAGE_SIZE"], type=int
+    )
+    if not 0 < limit <= MAX_LIMIT:
+        abort(400, f"limit måste vara mellan 1 och {MAX_LIMIT}!")
+
+    try:
+        page = database.get_rows(
+            [fields[name] for name in names],
+            order,
+            since,
+            limit,
+            after=request.args.get("after"),
+            where=where,
+        )
+    except ValueError:
+        abort(400, "Ogiltig sida!")
+
+    # The requested columns come first in every row, the cursor columns last.
+    return {
+        "items": [
+            {
+                name: (
+                    value.isoformat() if isinstance(value, datetime.datetime) else value
+                )
+                for name, value in zip(names, row)
+            }
+            for row in page.items
+        ],
+        "next_cursor": page.next_cursor,
+    }
@@ -0,0 +1,44 @@
+import datetime
+import secrets
+
+import click
+from flask.cli import AppGroup
+
+from receipt_helper import database
+from receipt_helper.api import hash_token
+from receipt_helper.model.api_token import ApiToken
+
+cli = AppGroup("api", help="Manage the tokens of the JSON API.")
+
+
+@cli.command("create-token")
+@click.argument("name")
+def create_token_command(name: str):
+    """Create a token for the service account NAME and print it."""
+    token = secrets.token_urlsafe(32)
+    created = database.add_api_token(
+        ApiToken(
+            name=name,
+            tokenHash=hash_token(token),
+            created=datetime.datetime.now(datetime.UTC),
+        )
+    )
+    if not created:
+        raise click.ClickException(f"A token named {name} already exists.")
+    click.echo(token)
+
+
+@cli.command("revoke-token")
+@click.argument("name")
+def revoke_token_command(name: str):
+    """Delete the token of the service account NAME."""
+    if not database.delete_api_token(name):
+        raise click.ClickException(f"No token named {name}.")
+    click.echo(f"Revoked the token of {name}.")
+
+
+@cli.command("list-tokens")
+def list_tokens_command():
+    """List the service accounts with a token."""
+    for token in database.get_api_tokens():
+        click.echo(f"{token.name}\tcreated {token.created:%Y-%m-%d %H:%M}")
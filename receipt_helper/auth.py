@@ -16,6 +16,7 @@ from werkzeug.security import check_password_hash, generate_password_hash
 from receipt_helper.database import (
     get_user,
     get_user_by_email,
+    get_user_snapshot,
     update_user_last_login,
     update_user_password,
     log_action,
@@ -26,6 +27,9 @@ from receipt_helper.model.user import User
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
 
+# Endpoints that never look at the logged in user.
+ANONYMOUS_ENDPOINTS = {"static", "healthz", "prometheus_metrics"}
+
 
 def context_passer():
     return dict(ClearanceEnum=ClearanceEnum, ReceiptStatusEnum=ReceiptStatusEnum)
@@ -131,9 +135,9 @@ def logout():
 @bp.before_app_request
 def load_logged_in_user():
     user_id = session.get("user_id")
-    if user_id is None:
+    if user_id is None or request.endpoint in ANONYMOUS_ENDPOINTS:
         g.user = None
     else:
-        g.user = get_user(user_id)
+        g.user = get_user_snapshot(user_id)
         if g.user is None:
             return
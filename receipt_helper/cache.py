@@ -0,0 +1,67 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, NamedTuple
+
+
+class UserSnapshot(NamedTuple):
+    """The parts of a `User` that are needed on every request."""
+
+    id: int
+    name: str
+    email: str
+    userTypeId: int
+    needs_password_change: bool
+
+
+class TTLCache:
+    """A thread safe LRU cache whose entries expire after `ttl` seconds.
+
+    The cache is per process. Entries are invalidated explicitly when the
+    process changes the underlying data, and the TTL bounds how long other
+    processes can serve a stale entry.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize: int, ttl: float):
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._entries.clear()
+
+    def get(self, key: Hashable) -> Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = TTLCache()
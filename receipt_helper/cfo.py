@@ -1,37 +1,39 @@
-import datetime
 import os
-import tempfile
-from shutil import make_archive, move
 
 from flask import (
     Blueprint,
+    abort,
     current_app,
     flash,
     g,
     redirect,
     render_template,
     request,
-    send_file,
+    stream_with_context,
     url_for,
 )
 
-from receipt_helper import database
+from receipt_helper import database, receipt_state
 from receipt_helper.auth import cfo_required, login_required
-from receipt_helper.database import (
-    change_receipt_status,
-    get_all_receipts,
-    get_receipt,
-    log_action,
+from receipt_helper.database import get_all_receipts, get_receipt
+from receipt_helper.enums import ReceiptStatusEnum
+from receipt_helper.etag import cached_by_changes
+from receipt_helper.export import stream_zip
+from receipt_helper.forms.receipt_forms import (
+    BulkActionForm,
+    ExportReceiptsForm,
+    RejectReceiptForm,
 )
-from receipt_helper.enums import LogTypeEnum, ReceiptStatusEnum
-from receipt_helper.forms.receipt_forms import RejectReceiptForm
 from receipt_helper.hooks import (
     post_approve_hook,
+    post_bulk_approve_hook,
+    post_bulk_reject_hook,
     post_reject_hook,
     pre_approve_hook,
     pre_reject_hook,
 )
-from receipt_helper.model.receipt import File
+from receipt_helper.receipt_state import TransitionError
+from receipt_helper.storage import browse_path, document_name
 
 bp = Blueprint("cfo", __name__, url_prefix="/cfo")
 
@@ -40,48 +42,152 @@ bp = Blueprint("cfo", __name__, url_prefix="/cfo")
 @login_required
 @cfo_required
 def index():
-    return render_template("cfo/index.html")
+    form = export_form()
+    return render_template(
+        "cfo/index.html",
+        form=form,
+        pending=database.get_status_totals(ReceiptStatusEnum.Pending),
+        months=database.get_monthly_totals(ReceiptStatusEnum.Handled),
+        spenders=database.get_top_spenders(ReceiptStatusEnum.Handled),
+    )
+
+
+def export_form() -> ExportReceiptsForm:
+    form = ExportReceiptsForm(request.args)
+    form.user.choices = [("", "Alla")] + [
+        (user.id, user.name) for user in database.get_users()
+    ]
+    return form
 
 
 @bp.route("/view_receipts")
 @login_required
 @cfo_required
+@cached_by_changes()
 def view_receipts():
-    receipts = get_all_receipts()
-    return render_template("cfo/view_receipts.html", receipts=receipts)
+    page = get_receipt_page(archived=False)
+    return render_template(
+        "cfo/view_receipts.html",
+        receipts=page.items,
+        page=page,
+        bulk_form=BulkActionForm(),
+    )
 
 
 @bp.route("/view_archived_receipts")
 @login_required
 @cfo_required
 def view_archived_receipts():
-    receipts = get_all_receipts(archived=True)
+    page = get_receipt_page(archived=True)
+
+    return render_template("cfo/view_archive.html", receipts=page.items, page=page)
 
-    return render_template("cfo/view_archive.html", receipts=receipts)
+
+def get_receipt_page(archived: bool):
+    try:
+        return get_all_receipts(
+            archived=archived,
+            page_size=current_app.config["RECEIPTS_PAGE_SIZE"],
+            after=request.args.get("after"),
+            before=request.args.get("before"),
+        )
+    except ValueError:
+        abort(400, "Ogiltig sida!")
 
 
 @bp.route("/get_receipts")
 @login_required
 @cfo_required
 def get_receipts():
-    file = tempfile.NamedTemporaryFile("w+b", suffix=".zip")
-    make_archive(
-        file.name.removesuffix(".zip"),
-        "zip",
-        current_app.config["RECEIPTS_STORAGE_PATH"],
+    form = export_form()
+    if not form.validate():
+        flash("Felaktigt filter för nedladdning!")
+        return redirect(url_for("cfo.index", **request.args))
+
+    files = database.get_export_files(
+        status=form.status.data,
+        archived=form.archived.data,
+        user=form.user.data,
+        receipt_date_from=form.receipt_date_from.data,
+        receipt_date_to=form.receipt_date_to.data,
+        submit_date_from=form.submit_date_from.data,
+        submit_date_to=form.submit_date_to.data,
+    )
+    entries = (
+        (
+            os.path.join(row.path, row.filename),
+            os.path.join(
+                browse_path(row.statusId, row.receipt_date, row.submit_date),
+                f"{row.id}_{document_name(row.receipt_date, row.name, row.filename)}",
+            ),
+        )
+        for row in files
     )
-    file.seek(0)
-    return send_file(file, download_name="kvitton.zip")  # type: ignore
+    return current_app.response_class(
+        stream_with_context(stream_zip(entries)),
+        mimetype="application/zip",
+        headers={"Content-Disposition": "attachment; filename=kvitton.zip"},
+    )
+
+
+# Hooks run before each receipt, and after all receipts, of a bulk action.
+BULK_HOOKS = {
+    "approve": (pre_approve_hook, post_bulk_approve_hook),
+    "reject": (pre_reject_hook, post_bulk_reject_hook),
+}
+
+
+@bp.route("/bulk", methods=("POST",))
+@login_required
+@cfo_required
+def bulk_action():
+    back = url_for(
+        "cfo.view_receipts",
+        after=request.args.get("after"),
+        before=request.args.get("before"),
+    )
+    form = BulkActionForm()
+    if not form.validate_on_submit():
+        for errors in form.errors.values():
+            flash(errors[0])
+        return redirect(back)
+
+    pre_hook, post_hook = BULK_HOOKS.get(form.action.data, (None, None))
+    versions = dict(form.receipts.data)
+    receipts = receipt_state.apply_many(
+        versions,
+        form.action.data,
+        g.user.id,
+        reason=form.reason.data or None,
+        check=pre_hook,
+    )
+    if post_hook is not None:
+        post_hook(receipts)
+
+    flash(f"{len(receipts)} kvitton uppdaterade.")
+    if len(receipts) < len(versions):
+        flash(
+            f"{len(versions) - len(receipts)} kvitton hade redan hanterats"
+            " eller ändrats och hoppades över."
+        )
+    return redirect(back)
 
 
 @bp.route("/<int:id>/archive")
 @login_required
 @cfo_required
 def archive_receipt(id: int):
-    if not database.archive_receipt(id):
+    receipt = get_receipt(id)
+    if not receipt:
         flash("Kvitto hittades ej!")
         return redirect(url_for("cfo.view_receipts"))
-    log_action("kvitto arkiverat", LogTypeEnum.CFO, g.user.id, receipt=id)
+
+    try:
+        receipt_state.apply(
+            receipt, "archive", g.user.id, version=request.args.get("version", type=int)
+        )
+    except TransitionError as ex:
+        flash(str(ex))
     return redirect(url_for("cfo.view_receipts"))
 
 
@@ -98,14 +204,14 @@ def approve_receipt(id: int):
     if not pre_approve_hook(receipt):
         return redirect(url_for("cfo.view_receipts"))
 
-    if not change_receipt_status(id, ReceiptStatusEnum.Handled):
-        flash("Kvitto hittades ej!")
+    try:
+        receipt_state.apply(
+            receipt, "approve", g.user.id, version=request.args.get("version", type=int)
+        )
+    except TransitionError as ex:
+        flash(str(ex))
         return redirect(url_for("cfo.view_receipts"))
 
-    move_file(receipt.file, "approved", receipt.receipt_date.date())
-
-    log_action("kvitto godkänt", LogTypeEnum.CFO, g.user.id, receipt=id)
-
     post_approve_hook(receipt)
 
     return redirect(url_for("cfo.view_receipts"))
@@ -130,14 +236,18 @@ def reject_receipt(id: int):
     if not pre_reject_hook(receipt):
         return redirect(url_for("cfo.view_receipts"))
 
-    if not change_receipt_status(id, ReceiptStatusEnum.Rejected, reason):
-        flash("Kvitto hittades ej!")
+    try:
+        receipt_state.apply(
+            receipt,
+            "reject",
+            g.user.id,
+            reason=reason,
+            version=request.args.get("version", type=int),
+        )
+    except TransitionError as ex:
+        flash(str(ex))
         return redirect(url_for("cfo.view_receipts"))
 
-    move_file(receipt.file, "rejected", receipt.receipt_date.date())
-
-    log_action("kvitto nekat", LogTypeEnum.CFO, g.user.id, receipt=id)
-
     post_reject_hook(receipt)
 
     return redirect(url_for("cfo.view_receipts"))
@@ -149,29 +259,15 @@ def reject_receipt(id: int):
 def move_receipt_to_submitted(id: int):
     receipt = get_receipt(id)
 
-    if not receipt or not change_receipt_status(id, ReceiptStatusEnum.Pending):
+    if not receipt:
         flash("Kvitto hittades ej!")
         return redirect(url_for("cfo.view_receipts"))
 
-    move_file(receipt.file, "submitted", receipt.submit_date.date())
-    log_action("kvitto pågående", LogTypeEnum.CFO, g.user.id, receipt=id)
+    try:
+        receipt_state.apply(
+            receipt, "reopen", g.user.id, version=request.args.get("version", type=int)
+        )
+    except TransitionError as ex:
+        flash(str(ex))
 
     return redirect(url_for("cfo.view_receipts"))
-
-
-def move_file(file: File, dest: str, date: datetime.date):
-    path = os.path.join(
-        current_app.config["RECEIPTS_STORAGE_PATH"], dest, date.isoformat()
-    )
-    os.makedirs(
-        path,
-        exist_ok=True,
-    )
-
-    filename = file.filename
-    dest_path = os.path.join(path, filename)
-
-    move(os.path.join(file.path, filename), dest_path)
-    file.path = path
-
-    database.commit()
@@ -1,27 +1,94 @@
 import datetime
-from typing import Sequence
+import re
+from typing import Iterable, Iterator, Sequence
 
-from sqlalchemy import exc
+from sqlalchemy import Row, column, exc, func, or_, table, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import InstrumentedAttribute, defer, joinedload
+from sqlalchemy.orm.interfaces import ORMOption
 
 from receipt_helper import db
-from receipt_helper.enums import ClearanceEnum, ReceiptStatusEnum
+from receipt_helper.cache import UserSnapshot, user_cache
+from receipt_helper.enums import (
+    ClearanceEnum,
+    EmailStatusEnum,
+    LogTypeEnum,
+    ReceiptStatusEnum,
+)
+from receipt_helper.model.api_token import ApiToken
+from receipt_helper.model.changes import ChangeCounter
+from receipt_helper.model.email import OutgoingEmail
 from receipt_helper.model.log import Log, LogType
-from receipt_helper.model.receipt import File, Receipt
+from receipt_helper.model.receipt import File, Receipt, ReceiptSummary
 from receipt_helper.model.user import User
+from receipt_helper.pagination import Page, page_offset, paginate, paginate_offset
+
+RECEIPT_QUEUE_ORDER = (
+    Receipt.statusId,
+    Receipt.submit_date,
+    Receipt.receipt_date,
+    Receipt.id,
+)
+
+# Loader profiles for receipt queries. List pages render the submitter, the
+# status and the file of every row, so those are joined into the main query
+# instead of being lazy loaded once per row.
+RECEIPT_LIST_LOAD: tuple[ORMOption, ...] = (
+    joinedload(Receipt.user),
+    joinedload(Receipt.status),
+    joinedload(Receipt.file),
+)
+NO_EAGER_LOAD: tuple[ORMOption, ...] = ()
+
+# FTS5 index of receipts, created and kept in sync by SQL triggers, see
+# `init_data.create_search_index`.
+RECEIPT_SEARCH = table(
+    "receipt_search", column("rowid"), column("rank"), column("userId")
+)
+LOG_ORDER = (Log.datetime, Log.id)
+LOG_LIST_LOAD: tuple[ORMOption, ...] = (
+    joinedload(Log.actionByUser),
+    joinedload(Log.user),
+    joinedload(Log.receipt).joinedload(Receipt.user),
+)
+
+
+def add(entity) -> None:
+    db.session.add(entity)
+
+
+def add_all(entities: Iterable) -> None:
+    db.session.add_all(entities)
 
 
 def commit():
     db.session.commit()
 
 
+def bump_changes() -> None:
+    """Bump the change counter, which invalidates the ETags of `etag`.
+
+    Does not commit, it is meant to be part of the transaction that changes
+    a receipt or a user.
+    """
+    db.session.execute(db.update(ChangeCounter).values(value=ChangeCounter.value + 1))
+
+
+def get_changes() -> int:
+    return db.session.execute(db.select(ChangeCounter.value)).scalar_one()
+
+
 def rollback():
     db.session.rollback()
 
 
-def get_user_receipts(user_id: int) -> Sequence[Receipt]:
+def get_user_receipts(
+    user_id: int, load: Sequence[ORMOption] = RECEIPT_LIST_LOAD
+) -> Sequence[Receipt]:
     receipts = (
         db.session.execute(
             db.select(Receipt)
+            .options(*load)
             .filter_by(userId=user_id)
             .order_by(Receipt.statusId, Receipt.submit_date, Receipt.receipt_date)
         )
@@ -31,56 +98,390 @@ def get_user_receipts(user_id: int) -> Sequence[Receipt]:
     return receipts
 
 
-def get_all_receipts(archived: bool | None = False) -> Sequence[Receipt]:
-    receipts = (
-        db.session.execute(
-            db.select(Receipt)
-            .filter_by(archived=archived)
-            .order_by(Receipt.statusId, Receipt.submit_date, Receipt.receipt_date)
-        )
-        .scalars()
-        .all()
+def get_all_receipts(
+    archived: bool | None = False,
+    page_size: int = 50,
+    after: str | None = None,
+    before: str | None = None,
+    load: Sequence[ORMOption] = RECEIPT_LIST_LOAD,
+) -> Page:
+    return paginate(
+        db.select(Receipt).options(*load).filter_by(archived=archived),
+        RECEIPT_QUEUE_ORDER,
+        page_size,
+        after=after,
+        before=before,
     )
-    return receipts
 
 
 def insert_receipt(receipt: Receipt) -> None:
     db.session.add(receipt)
+    try:
+        db.session.flush()
+    except exc.IntegrityError:
+        # Someone else stored the same document in the meantime, use theirs.
+        db.session.rollback()
+        file = receipt.file.sha256 and get_file_by_hash(receipt.file.sha256)
+        if not file:
+            raise
+        receipt.file = file
+        db.session.add(receipt)
+        db.session.flush()
+    summarize(receipt, 1)
+    bump_changes()
+    db.session.commit()
+
+
+def search_receipts(
+    query: str,
+    fts: bool,
+    user: int | None = None,
+    page_size: int = 50,
+    after: str | None = None,
+    before: str | None = None,
+    load: Sequence[ORMOption] = RECEIPT_LIST_LOAD,
+) -> Page:
+    """Receipts whose activity, status comment or submitter has every word.
+
+    Words match as prefixes. With `fts` the FTS5 index is used and all
+    matches are ranked by relevance, otherwise every receipt is scanned with
+    LIKE and the latest come first. Raises `ValueError` for malformed
+    cursors.
+    """
+    terms = re.findall(r"\w+", query)
+    if not terms:
+        return Page([], None, None)
+
+    select = db.select(Receipt).options(*load)
+    if fts:
+        matches = db.select(RECEIPT_SEARCH.c.rowid, RECEIPT_SEARCH.c.rank).where(
+            db.text("receipt_search MATCH :match").bindparams(
+                match=" ".join(f'"{term}"*' for term in terms)
+            )
+        )
+        if user is not None:
+            matches = matches.where(RECEIPT_SEARCH.c.userId == user)
+        # Every match is ranked, but only the narrow rows of the index are
+        # sorted. The receipts are joined to the matches up to the page.
+        matches = (
+            matches.order_by(RECEIPT_SEARCH.c.rank, RECEIPT_SEARCH.c.rowid.desc())
+            .limit(page_offset(page_size, after, before) + page_size + 1)
+            .subquery()
+        )
+        select = select.join(matches, matches.c.rowid == Receipt.id).order_by(
+            matches.c.rank, Receipt.id.desc()
+        )
+    else:
+        if user is not None:
+            select = select.where(Receipt.userId == user)
+        select = select.join(User, User.id == Receipt.userId)
+        for term in terms:
+            pattern = "%" + term.replace("_", "\\_") + "%"
+            select = select.where(
+                or_(
+                    Receipt.activity.ilike(pattern, escape="\\"),
+                    Receipt.statusComment.ilike(pattern, escape="\\"),
+                    User.name.ilike(pattern, escape="\\"),
+                )
+            )
+        select = select.order_by(Receipt.submit_date.desc(), Receipt.id.desc())
+    return paginate_offset(select, page_size, after, before)
+
+
+def get_file_by_hash(sha256: str) -> File | None:
+    return db.session.execute(db.select(File).filter_by(sha256=sha256)).scalar()
+
+
+def get_legacy_files() -> Sequence[File]:
+    """Files stored before the blob store, by path and status folder."""
+    return (
+        db.session.execute(db.select(File).where(File.sha256.is_(None))).scalars().all()
+    )
+
+
+def replace_file(old: File, new: File) -> None:
+    db.session.execute(
+        db.update(Receipt).where(Receipt.fileId == old.id).values(fileId=new.id)
+    )
+    db.session.delete(old)
     db.session.commit()
 
 
-def get_file(filename: str) -> File | None:
-    file = db.session.execute(db.select(File).filter_by(filename=filename)).scalar()
-    return file
+def get_export_files(
+    status: int | None = None,
+    archived: bool | None = None,
+    user: int | None = None,
+    receipt_date_from: datetime.date | None = None,
+    receipt_date_to: datetime.date | None = None,
+    submit_date_from: datetime.date | None = None,
+    submit_date_to: datetime.date | None = None,
+) -> Iterator[Row]:
+    """Yield the document location and listing details of matching receipts."""
+    query = (
+        db.select(
+            File.path,
+            File.filename,
+            Receipt.id,
+            Receipt.statusId,
+            Receipt.receipt_date,
+            Receipt.submit_date,
+            User.name,
+        )
+        .join(Receipt, Receipt.fileId == File.id)
+        .join(User, Receipt.userId == User.id)
+    )
+    if status is not None:
+        query = query.where(Receipt.statusId == status)
+    if archived is not None:
+        query = query.where(Receipt.archived == archived)
+    if user is not None:
+        query = query.where(Receipt.userId == user)
+    query = query.where(
+        *date_range(Receipt.receipt_date, receipt_date_from, receipt_date_to),
+        *date_range(Receipt.submit_date, submit_date_from, submit_date_to),
+    )
+    return iter(
+        db.session.execute(query.order_by(Receipt.id).execution_options(yield_per=500))
+    )
 
 
 def get_receipt(id: int) -> Receipt | None:
     return db.session.get(Receipt, id)
 
 
-def archive_receipt(id: int) -> bool:
-    receipt = db.session.get(Receipt, id)
-    if not receipt:
-        return False
-    receipt.archived = True
-    db.session.commit()
-    return True
+def get_receipts(
+    ids: Iterable[int], load: Sequence[ORMOption] = NO_EAGER_LOAD
+) -> Sequence[Receipt]:
+    return (
+        db.session.execute(
+            db.select(Receipt)
+            .options(*load)
+            .where(Receipt.id.in_(list(ids)))
+            .order_by(Receipt.id)
+        )
+        .scalars()
+        .all()
+    )
 
 
-def change_receipt_status(id: int, status: ReceiptStatusEnum, reason=None) -> bool:
-    receipt = db.session.get(Receipt, id)
-    if not receipt:
-        return False
-    receipt.statusId = status.value
-    receipt.statusComment = reason
+def update_receipts(versions: dict[int, int], **values) -> list[int]:
+    """Set `values` on every receipt still at its version in `versions`.
+
+    A single UPDATE, which bumps the versions just like the ORM does. Does
+    not commit. Returns the ids of the receipts that were updated.
+    """
+    if not versions:
+        return []
+    updated = list(
+        db.session.execute(
+            db.update(Receipt)
+            .where(tuple_(Receipt.id, Receipt.version).in_(list(versions.items())))
+            .values(version=Receipt.version + 1, **values)
+            .returning(Receipt.id)
+            .execution_options(synchronize_session=False)
+        ).scalars()
+    )
+    if updated:
+        bump_changes()
+    return updated
+
+
+def summarize(receipt: Receipt, count: int) -> None:
+    """Add `count` times `receipt` to its row in `ReceiptSummary`.
+
+    Called with -1 before and 1 after a status change. Does not commit, it is
+    meant to be part of the transaction that changes the receipt.
+    """
+    summarize_many([receipt], count)
+
+
+def summarize_many(
+    receipts: Iterable[Receipt], count: int, status: int | None = None
+) -> None:
+    """`summarize` for many receipts, in one upsert per summary row.
+
+    With `status` the receipts are counted as having that status, for
+    receipts whose status was changed by `update_receipts`.
+    """
+    totals: dict[tuple[int, str, str, int], list[int]] = {}
+    for receipt in receipts:
+        key = (
+            receipt.statusId if status is None else status,
+            receipt.receipt_date.strftime("%Y-%m"),
+            receipt.activity,
+            receipt.userId,
+        )
+        total = totals.setdefault(key, [0, 0])
+        total[0] += count
+        total[1] += count * receipt.amount
+    if not totals:
+        return
+
+    insert = sqlite_insert(ReceiptSummary)
+    db.session.execute(
+        insert.on_conflict_do_update(
+            index_elements=ReceiptSummary.__table__.primary_key.columns,
+            set_={
+                "count": ReceiptSummary.count + insert.excluded.count,
+                "amount": ReceiptSummary.amount + insert.excluded.amount,
+            },
+        ),
+        [
+            {
+                "statusId": statusId,
+                "month": month,
+                "activity": activity,
+                "userId": userId,
+                "count": count,
+                "amount": amount,
+            }
+            for (statusId, month, activity, userId), (count, amount) in totals.items()
+        ],
+    )
+
+
+def summary_select():
+    """`ReceiptSummary` rows computed from scratch from `Receipt`."""
+    month = func.strftime("%Y-%m", Receipt.receipt_date)
+    return db.select(
+        Receipt.statusId,
+        month.label("month"),
+        Receipt.activity,
+        Receipt.userId,
+        func.count().label("count"),
+        func.sum(Receipt.amount).label("amount"),
+    ).group_by(Receipt.statusId, month, Receipt.activity, Receipt.userId)
+
+
+def insert_summary_rows(select):
+    return db.insert(ReceiptSummary).from_select(
+        ["statusId", "month", "activity", "userId", "count", "amount"], select
+    )
+
+
+def rebuild_summary() -> None:
+    db.session.execute(db.delete(ReceiptSummary))
+    db.session.execute(insert_summary_rows(summary_select()))
     db.session.commit()
-    return True
+
+
+def get_summary_mismatches() -> list[tuple[tuple, tuple | None, tuple | None]]:
+    """Rows of `ReceiptSummary` that differ from a recount.
+
+    Returns `(key, expected, actual)` with `(count, amount)` totals.
+    """
+    expected = {
+        tuple(row[:4]): tuple(row[4:]) for row in db.session.execute(summary_select())
+    }
+    actual = {
+        tuple(row[:4]): tuple(row[4:])
+        for row in db.session.execute(
+            db.select(
+                ReceiptSummary.statusId,
+                ReceiptSummary.month,
+                ReceiptSummary.activity,
+                ReceiptSummary.userId,
+                ReceiptSummary.count,
+                ReceiptSummary.amount,
+            ).where(ReceiptSummary.count != 0)
+        )
+    }
+    return [
+        (key, expected.get(key), actual.get(key))
+        for key in sorted(expected.keys() | actual.keys())
+        if expected.get(key) != actual.get(key)
+    ]
+
+
+def get_status_totals(status: ReceiptStatusEnum) -> Row:
+    """`(count, amount)` of all receipts with `status`."""
+    return db.session.execute(
+        db.select(
+            func.coalesce(func.sum(ReceiptSummary.count), 0).label("count"),
+            func.coalesce(func.sum(ReceiptSummary.amount), 0).label("amount"),
+        ).where(ReceiptSummary.statusId == status.value)
+    ).one()
+
+
+def get_monthly_totals(status: ReceiptStatusEnum, months: int = 12) -> Sequence[Row]:
+    """`(month, count, amount)` of receipts with `status`, latest months first."""
+    return db.session.execute(
+        db.select(
+            ReceiptSummary.month,
+            func.sum(ReceiptSummary.count).label("count"),
+            func.sum(ReceiptSummary.amount).label("amount"),
+        )
+        .where(ReceiptSummary.statusId == status.value)
+        .group_by(ReceiptSummary.month)
+        .having(func.sum(ReceiptSummary.count) > 0)
+        .order_by(ReceiptSummary.month.desc())
+        .limit(months)
+    ).all()
+
+
+def get_top_spenders(
+    status: ReceiptStatusEnum, per_activity: int = 3, activities: int = 10
+) -> Sequence[Row]:
+    """`(activity, name, amount)` of the users with the largest totals.
+
+    The `per_activity` largest of each of the `activities` activities with
+    the largest totals, ordered by activity total and then user total.
+    """
+    per_user = (
+        db.select(
+            ReceiptSummary.activity,
+            ReceiptSummary.userId,
+            func.sum(ReceiptSummary.amount).label("amount"),
+        )
+        .where(ReceiptSummary.statusId == status.value)
+        .group_by(ReceiptSummary.activity, ReceiptSummary.userId)
+        .having(func.sum(ReceiptSummary.count) > 0)
+        .subquery()
+    )
+    ranked = db.select(
+        per_user,
+        func.row_number()
+        .over(partition_by=per_user.c.activity, order_by=per_user.c.amount.desc())
+        .label("rank"),
+        func.sum(per_user.c.amount)
+        .over(partition_by=per_user.c.activity)
+        .label("activity_amount"),
+    ).subquery()
+    top_activities = (
+        db.select(ranked.c.activity)
+        .where(ranked.c.rank == 1)
+        .order_by(ranked.c.activity_amount.desc())
+        .limit(activities)
+    )
+    return db.session.execute(
+        db.select(ranked.c.activity, User.name, ranked.c.amount)
+        .join(User, User.id == ranked.c.userId)
+        .where(ranked.c.rank <= per_activity, ranked.c.activity.in_(top_activities))
+        .order_by(ranked.c.activity_amount.desc(), ranked.c.activity, ranked.c.rank)
+    ).all()
 
 
 def get_user(id: int) -> User | None:
     return db.session.get(User, id)
 
 
+def get_user_snapshot(id: int) -> UserSnapshot | None:
+    """Cached lookup of the fields needed to authorize a request."""
+    snapshot = user_cache.get(id)
+    if snapshot is not None:
+        return snapshot
+    row = db.session.execute(
+        db.select(*(getattr(User, field) for field in UserSnapshot._fields)).where(
+            User.id == id
+        )
+    ).first()
+    if row is None:
+        return None
+    snapshot = UserSnapshot(*row)
+    user_cache.set(id, snapshot)
+    return snapshot
+
+
 def get_users() -> Sequence[User]:
     users = db.session.execute(db.select(User).where(User.id > 0)).scalars().all()
     return users
@@ -90,6 +491,11 @@ def get_user_by_email(email: str) -> User | None:
     return db.session.execute(db.select(User).filter_by(email=email)).scalars().first()
 
 
+def get_latest_login() -> datetime.datetime | None:
+    """Logins do not bump the change counter, see `etag`."""
+    return db.session.execute(db.select(db.func.max(User.lastLogin))).scalar()
+
+
 def update_user_last_login(id: int) -> bool:
     user = db.session.get(User, id)
     if not user:
@@ -105,13 +511,33 @@ def update_user_password(id: int, hashed_password: str) -> bool:
         return False
     user.password = hashed_password
     user.needs_password_change = False
+    bump_changes()
     db.session.commit()
+    user_cache.invalidate(id)
     return True
 
 
 def add_user(user: User) -> bool:
     try:
         db.session.add(user)
+        bump_changes()
+        db.session.commit()
+        return True
+    except exc.SQLAlchemyError:
+        db.session.rollback()
+        return False
+
+
+def add_users(users: Sequence[User], action: str, actionBy: int) -> bool:
+    """Insert `users` and a log entry for each in a single transaction."""
+    try:
+        db.session.add_all(users)
+        db.session.flush()
+        db.session.add_all(
+            make_log(action, LogTypeEnum.Admin, actionBy, user=user.id)
+            for user in users
+        )
+        bump_changes()
         db.session.commit()
         return True
     except exc.SQLAlchemyError:
@@ -119,6 +545,17 @@ def add_user(user: User) -> bool:
         return False
 
 
+def get_existing_emails(emails: Sequence[str], chunk_size: int = 500) -> set[str]:
+    existing = set()
+    for i in range(0, len(emails), chunk_size):
+        existing.update(
+            db.session.execute(
+                db.select(User.email).where(User.email.in_(emails[i : i + chunk_size]))
+            ).scalars()
+        )
+    return existing
+
+
 def update_user(id: int, name: str, email: str) -> bool:
     user = db.session.get(User, id)
     if not user:
@@ -126,10 +563,12 @@ def update_user(id: int, name: str, email: str) -> bool:
     user.name = name
     user.email = email
     try:
+        bump_changes()
         db.session.commit()
     except exc.IntegrityError:
         db.session.rollback()
         return False
+    user_cache.invalidate(id)
     return True
 
 
@@ -139,7 +578,9 @@ def reset_user_password(id: int, hashed_temp_password: str) -> bool:
         return False
     user.password = hashed_temp_password
     user.needs_password_change = True
+    bump_changes()
     db.session.commit()
+    user_cache.invalidate(id)
     return True
 
 
@@ -148,7 +589,9 @@ def add_user_role(id: int, new_role: ClearanceEnum) -> bool:
     if not user:
         return False
     user.userTypeId = user.userTypeId | new_role
+    bump_changes()
     db.session.commit()
+    user_cache.invalidate(id)
     return True
 
 
@@ -157,19 +600,38 @@ def remove_user_role(id: int, role: ClearanceEnum) -> bool:
     if not user:
         return False
     user.userTypeId = user.userTypeId & ~role
+    bump_changes()
     db.session.commit()
+    user_cache.invalidate(id)
     return True
 
 
-def delete_user(id: int) -> bool:
+def delete_user(id: int, actionBy: int) -> bool:
+    """Delete a user, and log it as done by `actionBy`.
+
+    The user's receipts and log entries, both those by and about the user,
+    are moved to the deleted-user placeholder.
+    """
     user = db.session.get(User, id)
     if not user:
         return False
     db.session.execute(
         db.update(Receipt).where(Receipt.userId == user.id).values(userId=0)
     )
+    db.session.execute(db.update(Log).where(Log.actionBy == user.id).values(actionBy=0))
+    db.session.execute(db.update(Log).where(Log.userId == user.id).values(userId=0))
+    db.session.execute(
+        db.delete(ReceiptSummary).where(ReceiptSummary.userId.in_((user.id, 0)))
+    )
+    db.session.execute(insert_summary_rows(summary_select().where(Receipt.userId == 0)))
     db.session.delete(user)
+    # Logged on the placeholder user, the deleted one is gone.
+    db.session.add(
+        make_log(f"användare {id} raderad", LogTypeEnum.Admin, actionBy, user=0)
+    )
+    bump_changes()
     db.session.commit()
+    user_cache.invalidate(id)
     return True
 
 
@@ -180,7 +642,18 @@ def log_action(
     receipt: int | None = None,
     user: int | None = None,
 ):
-    log_entry = Log(
+    db.session.add(make_log(action, log_type, actionBy, receipt, user))
+    db.session.commit()
+
+
+def make_log(
+    action: str,
+    log_type: LogType,
+    actionBy: int,
+    receipt: int | None = None,
+    user: int | None = None,
+) -> Log:
+    return Log(
         datetime=datetime.datetime.now(datetime.UTC),
         logTypeId=log_type,
         actionBy=actionBy,
@@ -188,12 +661,209 @@ def log_action(
         userId=user,
         action=action,
     )
-    db.session.add(log_entry)
+
+
+def date_range(
+    column, date_from: datetime.date | None, date_to: datetime.date | None
+) -> list:
+    """Conditions for `column` falling on or between the given dates."""
+    conditions = []
+    if date_from is not None:
+        conditions.append(
+            column >= datetime.datetime.combine(date_from, datetime.time.min)
+        )
+    if date_to is not None:
+        conditions.append(
+            column
+            < datetime.datetime.combine(
+                date_to + datetime.timedelta(days=1), datetime.time.min
+            )
+        )
+    return conditions
+
+
+def get_logs(
+    log_type: int | None = None,
+    action_by: int | None = None,
+    receipt: int | None = None,
+    user: int | None = None,
+    date_from: datetime.date | None = None,
+    date_to: datetime.date | None = None,
+    page_size: int = 50,
+    after: str | None = None,
+    before: str | None = None,
+    load: Sequence[ORMOption] = LOG_LIST_LOAD,
+) -> Page:
+    query = db.select(Log).options(*load)
+    if log_type is not None:
+        query = query.where(Log.logTypeId == log_type)
+    if action_by is not None:
+        query = query.where(Log.actionBy == action_by)
+    if receipt is not None:
+        query = query.where(Log.receiptId == receipt)
+    if user is not None:
+        query = query.where(Log.userId == user)
+    query = query.where(*date_range(Log.datetime, date_from, date_to))
+    return paginate(
+        query, LOG_ORDER, page_size, after=after, before=before, descending=True
+    )
+
+
+def get_rows(
+    columns: Sequence[InstrumentedAttribute],
+    order: Sequence[InstrumentedAttribute],
+    since: datetime.datetime | None = None,
+    page_size: int = 100,
+    after: str | None = None,
+    where: Sequence = (),
+) -> Page:
+    """Page of `Row`s of only `columns`, in the ascending keyset `order`.
+
+    `order` starts with a timestamp, which `since` is the lower bound of, and
+    its columns are selected as well so the cursor can be built. Rows changed
+    while paging move past the cursor and show up again on a later page.
+    """
+    keys = {c.key for c in columns}
+    selected = list(columns) + [c for c in order if c.key not in keys]
+    query = db.select(*selected).where(*where)
+    if since is not None:
+        query = query.where(order[0] >= since)
+    return paginate(query, order, page_size, after=after, rows=True)
+
+
+def get_api_token(token_hash: str) -> ApiToken | None:
+    return (
+        db.session.execute(db.select(ApiToken).filter_by(tokenHash=token_hash))
+        .scalars()
+        .first()
+    )
+
+
+def get_api_tokens() -> Sequence[ApiToken]:
+    return (
+        db.session.execute(db.select(ApiToken).order_by(ApiToken.name)).scalars().all()
+    )
+
+
+def add_api_token(token: ApiToken) -> bool:
+    try:
+        db.session.add(token)
+        db.session.commit()
+        return True
+    except exc.IntegrityError:
+        db.session.rollback()
+        return False
+
+
+def delete_api_token(name: str) -> bool:
+    deleted = db.session.execute(db.delete(ApiToken).filter_by(name=name)).rowcount
+    db.session.commit()
+    return deleted > 0
+
+
+def queue_emails(messages: Sequence[tuple[Sequence[str], str, str]]) -> None:
+    """Add `(recipients, subject, body)` messages to the outbox in one commit."""
+    now = datetime.datetime.now(datetime.UTC)
+    db.session.add_all(
+        OutgoingEmail(
+            recipients=",".join(recipients),
+            subject=subject,
+            body=body,
+            created=now,
+            nextAttempt=now,
+        )  # type: ignore
+        for recipients, subject, body in messages
+    )
+    db.session.commit()
+
+
+def claim_due_emails(limit: int, lease: datetime.timedelta) -> list[OutgoingEmail]:
+    """Mark up to `limit` due emails as being sent by this process.
+
+    Each row is claimed with a conditional update, so concurrent workers never
+    send the same email. A claim is a lease: if the worker dies while sending,
+    the email becomes due again once `lease` has passed.
+    """
+    now = datetime.datetime.now(datetime.UTC)
+    due = (
+        (OutgoingEmail.statusId == EmailStatusEnum.Queued)
+        | (OutgoingEmail.statusId == EmailStatusEnum.Sending)
+    ) & (OutgoingEmail.nextAttempt <= now)
+
+    ids = (
+        db.session.execute(
+            db.select(OutgoingEmail.id)
+            .where(due)
+            .order_by(OutgoingEmail.nextAttempt)
+            .limit(limit)
+        )
+        .scalars()
+        .all()
+    )
+    claimed = []
+    for id in ids:
+        result = db.session.execute(
+            db.update(OutgoingEmail)
+            .where(OutgoingEmail.id == id, due)
+            .values(statusId=EmailStatusEnum.Sending.value, nextAttempt=now + lease)
+        )
+        if result.rowcount == 1:
+            claimed.append(id)
+    db.session.commit()
+
+    if not claimed:
+        return []
+    return list(
+        db.session.execute(
+            db.select(OutgoingEmail)
+            .where(OutgoingEmail.id.in_(claimed))
+            .order_by(OutgoingEmail.id)
+        ).scalars()
+    )
+
+
+def mark_email_sent(email: OutgoingEmail) -> None:
+    """Record the email as sent, and drop its body, which may hold a password."""
+    email.statusId = EmailStatusEnum.Sent.value
+    email.sent = datetime.datetime.now(datetime.UTC)
+    email.attempts += 1
+    email.body = ""
+    email.lastError = None
+    db.session.commit()
+
+
+def mark_email_failed(
+    email: OutgoingEmail, error: str, retry_in: datetime.timedelta | None
+) -> None:
+    """Record a failed attempt and requeue it, or give up if `retry_in` is None.
+
+    An email that is given up on loses its body, like a sent one.
+    """
+    email.attempts += 1
+    email.lastError = error
+    if retry_in is None:
+        email.statusId = EmailStatusEnum.Failed.value
+        email.body = ""
+    else:
+        email.statusId = EmailStatusEnum.Queued.value
+        email.nextAttempt = datetime.datetime.now(datetime.UTC) + retry_in
     db.session.commit()
 
 
-def get_logs():
-    logs = (
-        db.session.execute(db.select(Log).order_by(Log.datetime.desc())).scalars().all()
+def get_emails(
+    status: int | None = None,
+    page_size: int = 50,
+    after: str | None = None,
+    before: str | None = None,
+) -> Page:
+    query = db.select(OutgoingEmail).options(defer(OutgoingEmail.body))
+    if status is not None:
+        query = query.where(OutgoingEmail.statusId == status)
+    return paginate(
+        query,
+        (OutgoingEmail.created, OutgoingEmail.id),
+        page_size,
+        after=after,
+        before=before,
+        descending=True,
     )
-    return logs
@@ -22,8 +22,29 @@ class LogTypeEnum(IntEnum):
     CFO = 30
 
 
+@unique
+class EmailStatusEnum(IntEnum):
+    Queued = 10
+    Sending = 20
+    Sent = 80
+    Failed = 90
+
+
 STATUS_COLOR_MAP = {
     ReceiptStatusEnum.Pending: "yellow",
     ReceiptStatusEnum.Handled: "lightgreen",
     ReceiptStatusEnum.Rejected: "red",
 }
+
+STATUS_FOLDER_MAP = {
+    ReceiptStatusEnum.Pending: "submitted",
+    ReceiptStatusEnum.Handled: "approved",
+    ReceiptStatusEnum.Rejected: "rejected",
+}
+
+EMAIL_STATUS_COLOR_MAP = {
+    EmailStatusEnum.Queued: "yellow",
+    EmailStatusEnum.Sending: "lightblue",
+    EmailStatusEnum.Sent: "lightgreen",
+    EmailStatusEnum.Failed: "red",
+}
@@ -0,0 +1,74 @@
+import functools
+import hashlib
+import importlib.metadata
+import os
+import time
+from typing import Callable
+
+from flask import current_app, g, make_response, request, session
+
+from receipt_helper import database
+
+
+def cached_by_changes(*keys: Callable[[], object]):
+    """Answer `If-None-Match` with 304 until a receipt or user changes.
+
+    The weak ETag is derived from the change counter bumped by `database`,
+    so checking it costs a single query of a single row and never touches
+    the receipt tables. `keys` return anything else the page depends on.
+    Pages with pending flashes are always rendered.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped_view(**kwargs):
+            if "_flashes" in session:
+                return view(**kwargs)
+            tag = make_etag([key() for key in keys])
+            if request.if_none_match.contains_weak(tag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(**kwargs))
+            response.set_etag(tag, weak=True)
+            # Pages are per user, and have to be revalidated on every view.
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+
+        return wrapped_view
+
+    return decorator
+
+
+def make_etag(extra: list) -> str:
+    parts = [
+        database.get_changes(),
+        # A deploy changes the pages without changing any data.
+        current_app.config["RECEIPTS_BUILD_ID"],
+        # The navigation bar shows the role of the user.
+        tuple(g.user),
+        request.full_path,
+        # The CSRF tokens in the page stay valid as long as the session token
+        # and at least half of their time limit.
+        session.get("csrf_token"),
+        *extra,
+    ]
+    time_limit = current_app.config.get("WTF_CSRF_TIME_LIMIT", 3600)
+    if time_limit:
+        parts.append(int(time.time() // (time_limit / 2)))
+    return hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+
+
+def build_id(root: str) -> str:
+    """The package version and the time of the latest change to any file of
+    the package under `root`, its templates and static files included."""
+    try:
+        version = importlib.metadata.version("receipt_helper")
+    except importlib.metadata.PackageNotFoundError:
+        version = ""
+    latest = max(
+        os.path.getmtime(os.path.join(path, name))
+        for path, dirs, names in os.walk(root)
+        if "__pycache__" not in path
+        for name in names
+    )
+    return f"{version}-{latest:.0f}"
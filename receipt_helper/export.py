@@ -0,0 +1,82 @@
+import os
+import time
+import zipfile
+from typing import Iterable, Iterator
+
+from flask import current_app
+
+from receipt_helper.metrics import EXPORT_SECONDS
+
+CHUNK_SIZE = 64 * 1024
+
+# Formats that are already compressed, deflating them only costs CPU.
+STORED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".pdf"}
+
+
+class _StreamBuffer:
+    """Write-only file object that collects what `zipfile` writes to it.
+
+    It has no `seek`, so `zipfile` treats it as an unseekable stream and
+    writes data descriptors instead of going back to patch local headers.
+    """
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self) -> Iterator[bytes]:
+        if self._chunks:
+            data = b"".join(self._chunks)
+            self._chunks.clear()
+            yield data
+
+
+def stream_zip(entries: Iterable[tuple[str, str]]) -> Iterator[bytes]:
+    """Yield a ZIP archive of `(path, arcname)` entries piece by piece.
+
+    Files are read in `CHUNK_SIZE` blocks and every block is handed on as
+    soon as it has been written, so memory use does not depend on the size
+    of the archive and nothing is written to disk.
+    """
+    started = time.perf_counter()
+    try:
+        yield from _stream_zip(entries)
+    finally:
+        # Also when the client goes away and the generator is closed.
+        EXPORT_SECONDS.observe(time.perf_counter() - started)
+
+
+def _stream_zip(entries: Iterable[tuple[str, str]]) -> Iterator[bytes]:
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for path, arcname in entries:
+            try:
+                info = zipfile.ZipInfo.from_file(path, arcname)
+                src = open(path, "rb")
+            except FileNotFoundError:
+                current_app.logger.warning(f"Missing receipt file in export: {path}")
+                continue
+
+            extension = os.path.splitext(arcname)[1].lower()
+            if extension in STORED_EXTENSIONS:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+
+            with src, archive.open(info, "w") as dst:
+                while chunk := src.read(CHUNK_SIZE):
+                    dst.write(chunk)
+                    yield from buffer.drain()
+            yield from buffer.drain()
+    yield from buffer.drain()
@@ -0,0 +1,18 @@
+def optional_int(value):
+    if value in (None, ""):
+        return None
+    return int(value)
+
+
+def optional_bool(value):
+    if value in (None, ""):
+        return None
+    if isinstance(value, bool):
+        return value
+    return value == "1"
+
+
+def id_version(value: str) -> tuple[int, int]:
+    """Parse an "id:version" pair, raises `ValueError` if malformed."""
+    id, version = value.split(":")
+    return int(id), int(version)
@@ -0,0 +1,22 @@
+from flask_wtf import FlaskForm
+from wtforms import DateField, IntegerField, SelectField, validators
+
+from receipt_helper.enums import LogTypeEnum
+from receipt_helper.forms.fields import optional_int
+
+
+class LogFilterForm(FlaskForm):
+    class Meta:
+        csrf = False
+
+    log_type = SelectField(
+        "Typ",
+        [validators.Optional()],
+        choices=[("", "Alla")] + [(t.value, t.name) for t in LogTypeEnum],
+        coerce=optional_int,
+    )
+    actor = SelectField("Utförd av", [validators.Optional()], coerce=optional_int)
+    user = SelectField("Användare", [validators.Optional()], coerce=optional_int)
+    receipt = IntegerField("Kvitto-id", [validators.Optional()])
+    date_from = DateField("Från och med", [validators.Optional()])
+    date_to = DateField("Till och med", [validators.Optional()])
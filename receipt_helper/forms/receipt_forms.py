@@ -1,6 +1,18 @@
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileAllowed, FileField, FileRequired
-from wtforms import DateField, DecimalField, SelectField, StringField, validators
+from wtforms import (
+    DateField,
+    DecimalField,
+    SelectField,
+    SelectMultipleField,
+    StringField,
+    validators,
+)
+
+from receipt_helper.enums import ReceiptStatusEnum
+from receipt_helper.forms.fields import id_version, optional_bool, optional_int
+
+RECEIPT_EXTENSIONS = ["png", "jpeg", "jpg", "gif", "tiff", "raw", "svg", "webp", "pdf"]
 
 
 class SubmitReceiptForm(FlaskForm):
@@ -19,10 +31,7 @@ class SubmitReceiptForm(FlaskForm):
         "Fil",
         validators=[
             FileRequired("Fil krävs"),
-            FileAllowed(
-                ["png", "jpeg", "jpg", "gif", "tiff", "raw", "svg", "webp", "pdf"],
-                "Endast bild/pdf är tilåtet!",
-            ),
+            FileAllowed(RECEIPT_EXTENSIONS, "Endast bild/pdf är tilåtet!"),
         ],
     )
     user = SelectField("Användare", coerce=int)
@@ -33,3 +42,50 @@ class RejectReceiptForm(FlaskForm):
         "Anledning",
         [validators.data_required("Anledning krävs"), validators.Length(max=250)],
     )
+
+
+class BulkActionForm(FlaskForm):
+    action = SelectField(
+        "Åtgärd",
+        choices=[
+            ("approve", "Hanterad"),
+            ("reject", "Neka"),
+            ("reopen", "Pågående"),
+            ("archive", "Arkivera"),
+        ],
+    )
+    reason = StringField("Anledning", [validators.Length(max=250)])
+    receipts = SelectMultipleField(
+        "Kvitton",
+        [validators.DataRequired("Inga kvitton valda")],
+        coerce=id_version,
+        validate_choice=False,
+    )
+    """"id:version" of every selected receipt."""
+
+    def validate_reason(self, field):
+        if self.action.data == "reject" and not field.data:
+            raise validators.ValidationError("Anledning krävs")
+
+
+class ExportReceiptsForm(FlaskForm):
+    class Meta:
+        csrf = False
+
+    status = SelectField(
+        "Status",
+        [validators.Optional()],
+        choices=[("", "Alla")] + [(s.value, s.name) for s in ReceiptStatusEnum],
+        coerce=optional_int,
+    )
+    archived = SelectField(
+        "Arkiverade",
+        [validators.Optional()],
+        choices=[("", "Alla"), ("0", "Ej arkiverade"), ("1", "Arkiverade")],
+        coerce=optional_bool,
+    )
+    user = SelectField("Användare", [validators.Optional()], coerce=optional_int)
+    receipt_date_from = DateField("Kvittodatum från", [validators.Optional()])
+    receipt_date_to = DateField("Kvittodatum till", [validators.Optional()])
+    submit_date_from = DateField("Inskickat från", [validators.Optional()])
+    submit_date_to = DateField("Inskickat till", [validators.Optional()])
@@ -0,0 +1,80 @@
+"""Production gunicorn settings, used with
+
+    gunicorn -c python:receipt_helper.gunicorn_config "receipt_helper:create_app()"
+
+Every setting can be overridden with the GUNICORN_* variables below.
+"""
+
+import os
+import shutil
+import tempfile
+
+# prometheus_client picks its storage when imported, so this has to be set
+# before the app is. Every worker writes its metrics to files of its own
+# there, and /metrics sums them. Counters left over from the previous run
+# would be summed in too, so the folder is emptied first, before the
+# preloaded app writes any files of its own.
+metrics_dir = os.getenv(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join(
+        "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+        "receipts-metrics",
+    ),
+)
+shutil.rmtree(metrics_dir, ignore_errors=True)
+os.makedirs(metrics_dir)
+os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+
+from prometheus_client import multiprocess  # noqa: E402
+
+from receipt_helper import db, start_background_threads  # noqa: E402
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+
+# Request threads wait on SMTP, SQLite and the disk far more than they
+# compute, so threads per worker serve slow requests like exports without
+# blocking the rest of the site.
+worker_class = "gthread"
+workers = int(os.getenv("GUNICORN_WORKERS", 2 * (os.cpu_count() or 1) + 1))
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+
+# Import the app once in the master, the workers share its memory copy on
+# write and start faster.
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+# The gthread worker heartbeats from its main thread, so the timeout only
+# catches hung workers. Long running exports are instead covered by the
+# graceful timeout, which lets them finish on restarts and deploys.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 300))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+
+# The heartbeat file is touched constantly, keep it off the overlay file
+# system in containers.
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+
+def when_ready(server):
+    # The master serves no requests, close the connections it opened while
+    # creating the app so no worker inherits them.
+    if preload_app:
+        with server.app.wsgi().app_context():
+            db.engine.dispose()
+
+
+def post_fork(server, worker):
+    app = worker.app.wsgi()
+    with app.app_context():
+        if preload_app:
+            # Connections are not safe to share between processes. Drop the
+            # inherited pool without closing the parent's connections.
+            db.engine.dispose(close=False)
+        # Threads do not survive a fork, so the email sender and the SQLite
+        # maintenance are started in every worker instead of in the master.
+        start_background_threads(app)
+
+
+def child_exit(server, worker):
+    # Keeps the live gauges of dead workers out of the sums.
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,12 +1,12 @@
-from smtplib import SMTPException
+from typing import Sequence
 
-from flask import current_app, flash, url_for
+from flask import url_for
 
 from receipt_helper.database import get_users
 from receipt_helper.enums import ClearanceEnum
 from receipt_helper.forms.receipt_forms import SubmitReceiptForm
 from receipt_helper.model.receipt import Receipt
-from receipt_helper.util import send_email
+from receipt_helper.outbox import queue_email, queue_emails
 
 
 def pre_submit_hook(form: SubmitReceiptForm):
@@ -23,20 +23,17 @@ def post_submit_hook(receipt: Receipt):
     ]
 
     if cfo_emails:
-        try:
-            send_email(
-                cfo_emails,
-                "Ny kvittoredovisning",
-                f"""Hej,
+        queue_email(
+            cfo_emails,
+            "Ny kvittoredovisning",
+            f"""Hej,
 
 Det har inkommit en ny kvittoredovisning från {receipt.user.name}:
 
 {url_for('main.view_receipt', id=receipt.id, _external=True)}
 
 """,
-            )
-        except SMTPException:
-            return False
+        )
     return True
 
 
@@ -48,21 +45,38 @@ def post_approve_hook(receipt: Receipt):
     return True
 
 
+def post_bulk_approve_hook(receipts: Sequence[Receipt]):
+    """Called after many receipts have been approved at once."""
+    for receipt in receipts:
+        post_approve_hook(receipt)
+    return True
+
+
 def pre_reject_hook(receipt: Receipt):
     return True
 
 
 def post_reject_hook(receipt: Receipt):
-    try:
-        send_email(
-            receipt.user.email,
-            "Kvittoredovisning nekad",
-            f"""Hej,
+    queue_email(*rejection_email(receipt))
+    return True
+
+
+def post_bulk_reject_hook(receipts: Sequence[Receipt]):
+    """Called after many receipts have been rejected at once.
+
+    Queues all the emails in a single commit.
+    """
+    if receipts:
+        queue_emails([rejection_email(receipt) for receipt in receipts])
+    return True
+
+
+def rejection_email(receipt: Receipt) -> tuple[str, str, str]:
+    return (
+        receipt.user.email,
+        "Kvittoredovisning nekad",
+        f"""Hej,
 
 En av dina kvittoredovisningar har blivit nekad. För mer detaljer, se {url_for('main.view_receipt', id=receipt.id, _external=True)}.
 """,
-        )
-    except SMTPException:
-        flash("Misslyckades med att skicka nekande-mejl.")
-        return False
-    return True
+    )
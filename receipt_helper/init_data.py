@@ -1,61 +1,287 @@
 from functools import reduce
 from itertools import combinations_with_replacement
 
+from sqlalchemy import Connection, MetaData, Row, inspect, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateColumn
 from werkzeug.security import generate_password_hash
 
+from receipt_helper import db
+from receipt_helper.database import insert_summary_rows, summary_select
 from receipt_helper.enums import (
     STATUS_COLOR_MAP,
     ClearanceEnum,
+    EmailStatusEnum,
     ReceiptStatusEnum,
     LogTypeEnum,
 )
-from receipt_helper.model.log import LogType
-from receipt_helper.model.receipt import Receipt, ReceiptStatus
+from receipt_helper.model.api_token import ApiToken  # noqa: F401
+from receipt_helper.model.changes import ChangeCounter
+from receipt_helper.model.email import OutgoingEmail
+from receipt_helper.model.log import Log, LogType
+from receipt_helper.model.model import utcnow
+from receipt_helper.model.receipt import Receipt, ReceiptStatus, ReceiptSummary
+from receipt_helper.model.schema import SchemaVersion
 from receipt_helper.model.user import User
 from receipt_helper.model.usertype import UserType
 
 
-def init_db(app, db):
-    try:
-        with app.app_context():
-            db.create_all()
-            for log_type in LogTypeEnum:
-                db.session.add(
-                    LogType(
-                        id=log_type.value,
-                        name=log_type.name,
-                    )
+def add_missing_columns(conn: Connection, metadata: MetaData):
+    """Add columns that were added to a model after its table was created.
+
+    New non-nullable columns need a `server_default` for this to work.
+    """
+    inspector = inspect(conn)
+    for table in metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = CreateColumn(column).compile(dialect=conn.dialect)
+            conn.execute(
+                text(
+                    f"ALTER TABLE {conn.dialect.identifier_preparer.format_table(table)} ADD COLUMN {ddl}"
                 )
-            clearances = combinations_with_replacement(
-                ClearanceEnum, len(ClearanceEnum)
             )
-            clearances = [
-                reduce(lambda curr, next: curr | next, clearance)
-                for clearance in clearances
-            ]
-            clearances = set(clearances)
-            for clearance in clearances:
-                db.session.add(UserType(id=clearance.value, name=clearance.name))
-            for status in ReceiptStatusEnum:
-                db.session.add(
-                    ReceiptStatus(
-                        id=status.value,
-                        displayName=status.name,
-                        displayColor=STATUS_COLOR_MAP[status],
-                    )
-                )
-            db.session.add(User(id=0, email="DELETED", name="DELETED", password="a"))
-            db.session.add(
-                User(
-                    email=app.config["RECEIPTS_ADMIN_USER_EMAIL"],
-                    name=app.config["RECEIPTS_ADMIN_USER_NAME"],
-                    password=generate_password_hash(
-                        app.config["RECEIPTS_ADMIN_USER_PASSWORD"]
-                    ),
-                    userTypeId=(ClearanceEnum.User | ClearanceEnum.Admin),
-                )
+
+
+SEARCH_INDEX_DDL = (
+    """CREATE VIRTUAL TABLE receipt_search USING fts5(
+        activity, statusComment, name, userId UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER receipt_search_insert AFTER INSERT ON receipt BEGIN
+        INSERT INTO receipt_search (rowid, activity, statusComment, name, userId)
+        VALUES (
+            new.id, new.activity, new.statusComment,
+            (SELECT name FROM "user" WHERE id = new.userId), new.userId
+        );
+    END""",
+    """CREATE TRIGGER receipt_search_update
+    AFTER UPDATE OF activity, statusComment, userId ON receipt BEGIN
+        UPDATE receipt_search SET
+            activity = new.activity,
+            statusComment = new.statusComment,
+            name = (SELECT name FROM "user" WHERE id = new.userId),
+            userId = new.userId
+        WHERE rowid = new.id;
+    END""",
+    """CREATE TRIGGER receipt_search_delete AFTER DELETE ON receipt BEGIN
+        DELETE FROM receipt_search WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER receipt_search_rename AFTER UPDATE OF name ON "user" BEGIN
+        UPDATE receipt_search SET name = new.name
+        WHERE rowid IN (SELECT id FROM receipt WHERE userId = new.id);
+    END""",
+    """INSERT INTO receipt_search (rowid, activity, statusComment, name, userId)
+    SELECT receipt.id, receipt.activity, receipt.statusComment, "user".name,
+        receipt.userId
+    FROM receipt JOIN "user" ON "user".id = receipt.userId""",
+)
+
+
+def create_search_index(conn: Connection) -> bool:
+    """Create and fill the FTS5 index of receipts, kept in sync by triggers.
+
+    Returns False if SQLite is built without FTS5, searches then fall back
+    to LIKE, see `database.search_receipts`.
+    """
+    if inspect(conn).has_table("receipt_search"):
+        return True
+    try:
+        conn.execute(text(SEARCH_INDEX_DDL[0]))
+    except OperationalError:
+        return False
+    for ddl in SEARCH_INDEX_DDL[1:]:
+        conn.execute(text(ddl))
+    return True
+
+
+def migrate_1(app, conn: Connection):
+    """Versioning starts here, so this brings any earlier database up to date."""
+    conn.execute(db.delete(ReceiptSummary))
+    conn.execute(insert_summary_rows(summary_select()))
+
+
+def migrate_2(app, conn: Connection):
+    """Date the new `updated` columns, receipts by when they were submitted."""
+    conn.execute(db.update(Receipt).values(updated=Receipt.submit_date))
+    conn.execute(db.update(User).values(updated=utcnow()))
+
+
+def migrate_3(app, conn: Connection):
+    """Start the change counter behind the ETags of the list pages."""
+    conn.execute(
+        sqlite_insert(ChangeCounter).values(id=1, value=0).on_conflict_do_nothing()
+    )
+
+
+def migrate_4(app, conn: Connection):
+    """Drop the bodies of emails that are done, they may hold passwords."""
+    conn.execute(
+        db.update(OutgoingEmail)
+        .where(
+            OutgoingEmail.statusId.in_(
+                [EmailStatusEnum.Sent.value, EmailStatusEnum.Failed.value]
+            )
+        )
+        .values(body="")
+    )
+
+
+def migrate_5(app, conn: Connection):
+    """Move log entries of already deleted users to the placeholder user."""
+    users = db.select(User.id)
+    conn.execute(
+        db.update(Log)
+        .where(Log.userId.is_not(None), Log.userId.not_in(users))
+        .values(userId=0)
+    )
+    conn.execute(db.update(Log).where(Log.actionBy.not_in(users)).values(actionBy=0))
+
+
+MIGRATIONS = [migrate_1, migrate_2, migrate_3, migrate_4, migrate_5]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+"""A database at this version has had every migration applied."""
+
+
+def sync_schema(conn: Connection):
+    """Create missing tables, columns and indexes."""
+    db.metadata.create_all(conn)
+    add_missing_columns(conn, db.metadata)
+    # create_all skips tables that already exist, so indexes added to
+    # existing tables have to be created separately.
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def seed(app, conn: Connection):
+    """Insert or update the reference data, and make sure there is an admin."""
+
+    def upsert(model, rows: list[dict]):
+        insert = sqlite_insert(model)
+        conn.execute(
+            insert.on_conflict_do_update(
+                index_elements=[model.id],
+                set_={
+                    key: insert.excluded[key] for key in rows[0].keys() if key != "id"
+                },
+            ),
+            rows,
+        )
+
+    upsert(
+        LogType,
+        [{"id": log_type.value, "name": log_type.name} for log_type in LogTypeEnum],
+    )
+    clearances = combinations_with_replacement(ClearanceEnum, len(ClearanceEnum))
+    clearances = {
+        reduce(lambda curr, next: curr | next, clearance) for clearance in clearances
+    }
+    upsert(
+        UserType,
+        [{"id": clearance.value, "name": clearance.name} for clearance in clearances],
+    )
+    upsert(
+        ReceiptStatus,
+        [
+            {
+                "id": status.value,
+                "displayName": status.name,
+                "displayColor": STATUS_COLOR_MAP[status],
+            }
+            for status in ReceiptStatusEnum
+        ],
+    )
+    conn.execute(
+        sqlite_insert(User)
+        .values(id=0, email="DELETED", name="DELETED", password="a")
+        .on_conflict_do_nothing()
+    )
+
+    has_admin = conn.execute(
+        db.select(User.id).where(
+            User.userTypeId.op("&")(ClearanceEnum.Admin.value) != 0
+        )
+    ).first()
+    if not has_admin and app.config["RECEIPTS_ADMIN_USER_EMAIL"]:
+        conn.execute(
+            sqlite_insert(User)
+            .values(
+                email=app.config["RECEIPTS_ADMIN_USER_EMAIL"],
+                name=app.config["RECEIPTS_ADMIN_USER_NAME"],
+                password=generate_password_hash(
+                    app.config["RECEIPTS_ADMIN_USER_PASSWORD"]
+                ),
+                needs_password_change=True,
+                userTypeId=(ClearanceEnum.User | ClearanceEnum.Admin).value,
             )
-            db.session.commit()
+            .on_conflict_do_update(
+                index_elements=[User.email],
+                set_={"userTypeId": User.userTypeId.op("|")(ClearanceEnum.Admin.value)},
+            )
+        )
+
+
+def get_schema_version(conn: Connection) -> Row | None:
+    try:
+        return conn.execute(
+            db.select(SchemaVersion.version, SchemaVersion.search_fts).where(
+                SchemaVersion.id == 1
+            )
+        ).first()
+    except OperationalError:
+        return None
+
+
+def migrate(app, conn: Connection, version: int) -> bool:
+    """Run the migrations after `version` and seed the reference data.
+
+    Returns whether the search index is available.
+    """
+    sync_schema(conn)
+    for migration in MIGRATIONS[version:]:
+        app.logger.info(f"Running {migration.__name__}")
+        migration(app, conn)
+    search_fts = create_search_index(conn)
+    seed(app, conn)
+    conn.execute(
+        sqlite_insert(SchemaVersion)
+        .values(id=1, version=SCHEMA_VERSION, search_fts=search_fts)
+        .on_conflict_do_update(
+            index_elements=[SchemaVersion.id],
+            set_={"version": SCHEMA_VERSION, "search_fts": search_fts},
+        )
+    )
+    return search_fts
+
+
+def init_db(app):
+    """Bring the database up to `SCHEMA_VERSION`.
 
-    except Exception as ex:
-        print(ex)
+    An up to date database costs a single query. Otherwise the migrations run
+    in one transaction holding SQLite's write lock, so of several workers
+    booting at once one migrates and the others find it done.
+    """
+    with app.app_context(), db.engine.connect() as conn:
+        # Transactions are begun explicitly below, DDL included.
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        current = get_schema_version(conn)
+        if current is None or current.version != SCHEMA_VERSION:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+            try:
+                current = get_schema_version(conn)
+                if current is None or current.version != SCHEMA_VERSION:
+                    search_fts = migrate(app, conn, current.version if current else 0)
+                else:
+                    search_fts = current.search_fts
+                conn.exec_driver_sql("COMMIT")
+            except BaseException:
+                conn.exec_driver_sql("ROLLBACK")
+                raise
+        else:
+            search_fts = current.search_fts
+    app.config["RECEIPTS_SEARCH_FTS"] = app.config["RECEIPTS_SEARCH_FTS"] and search_fts
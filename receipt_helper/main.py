@@ -10,12 +10,11 @@ from flask import (
     redirect,
     render_template,
     request,
-    send_from_directory,
     url_for,
 )
-from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 
-from receipt_helper import database
+from receipt_helper import database, metrics
 from receipt_helper.auth import login_required
 from receipt_helper.database import (
     get_receipt,
@@ -24,21 +23,53 @@ from receipt_helper.database import (
     log_action,
 )
 from receipt_helper.enums import ClearanceEnum, LogTypeEnum
-from receipt_helper.forms.receipt_forms import SubmitReceiptForm
+from receipt_helper.etag import cached_by_changes
+from receipt_helper.forms.receipt_forms import RECEIPT_EXTENSIONS, SubmitReceiptForm
 from receipt_helper.hooks import post_submit_hook, pre_submit_hook
 from receipt_helper.model.receipt import File, Receipt
+from receipt_helper.previews import PREVIEW_SIZES, get_preview, schedule_previews
+from receipt_helper.storage import UploadFile, send_stored_file
 
 bp = Blueprint("main", __name__, url_prefix="/")
 
 
+@bp.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    limit = current_app.config["MAX_CONTENT_LENGTH"] // (1024 * 1024)
+    flash(f"Filen är för stor, max {limit} MB.")
+    return redirect(url_for("main.add_receipt"))
+
+
 @bp.route("/")
 @login_required
+@cached_by_changes()
 def index():
     receipts = get_user_receipts(g.user.id)
 
     return render_template("main/index.html", receipts=receipts)
 
 
+@bp.route("/search")
+@login_required
+def search():
+    query = request.args.get("q", "")
+    is_cfo = ClearanceEnum.CFO in ClearanceEnum(g.user.userTypeId)
+    try:
+        page = database.search_receipts(
+            query,
+            current_app.config["RECEIPTS_SEARCH_FTS"],
+            user=None if is_cfo else g.user.id,
+            page_size=current_app.config["RECEIPTS_PAGE_SIZE"],
+            after=request.args.get("after"),
+            before=request.args.get("before"),
+        )
+    except ValueError:
+        abort(400, "Ogiltig sida!")
+    return render_template(
+        "main/search.html", query=query, receipts=page.items, page=page
+    )
+
+
 @bp.route("/add", methods=("GET", "POST"))
 @login_required
 def add_receipt():
@@ -61,40 +92,37 @@ def add_receipt():
         return redirect(url_for("main.add_receipt"))
 
     receipt_date = form.receipt_date.data
-    receipt_date_str = receipt_date.isoformat()
     activity = form.activity.data
     amount = int(form.amount.data * 100)
     submit_date = datetime.date.today()
-    submit_date_str = submit_date.isoformat()
     file = form.file.data
     user_id = form.user.data
 
     if user_id != g.user.id and (g.user.userTypeId & ClearanceEnum.CFO) == 0:
         abort(403)
 
-    user = database.get_user(user_id)
-
-    os.makedirs(
-        os.path.join(
-            current_app.config["RECEIPTS_STORAGE_PATH"], "submitted", submit_date_str
-        ),
-        exist_ok=True,
-    )
+    # FileAllowed only checks the end of the name, so ".pdf" passes it too.
+    extension = os.path.splitext(file.filename)[-1].lower()
+    if extension[1:] not in RECEIPT_EXTENSIONS:
+        flash("Endast bild/pdf är tilåtet!")
+        return redirect(url_for("main.add_receipt"))
 
-    filename = secure_filename(
-        f"{receipt_date_str}_{user.name}{os.path.splitext(file.filename)[-1]}"
-    )
-    filename = os.path.join(
-        current_app.config["RECEIPTS_STORAGE_PATH"],
-        "submitted",
-        submit_date_str,
-        filename,
-    )
-    filename = uniquify(filename)
-    file.save(filename)
+    # Already hashed while streamed to disk, see `storage.UploadRequest`.
+    upload: UploadFile = file.stream
+    receipt_file = database.get_file_by_hash(upload.sha256)
+    if not receipt_file:
+        # Otherwise share the identical document already stored.
+        path, filename = upload.store(
+            current_app.config["RECEIPTS_STORAGE_PATH"], extension
+        )
+        receipt_file = File(
+            path=path,
+            filename=filename,
+            sha256=upload.sha256,
+            mimetype=upload.mimetype,
+            size=upload.size,
+        )  # type: ignore
 
-    path, filename = os.path.split(filename)
-    receipt_file = File(filename=filename, path=path)  # type: ignore
     receipt = Receipt(
         userId=user_id,
         receipt_date=receipt_date,
@@ -105,23 +133,15 @@ def add_receipt():
     )  # type: ignore
 
     insert_receipt(receipt)
+    metrics.RECEIPTS_SUBMITTED.inc()
+    metrics.UPLOAD_BYTES.inc(upload.size)
     log_action("kvitto tillagt", LogTypeEnum.User, g.user.id, receipt.id)
     if not post_submit_hook(receipt):
         pass
+    schedule_previews(receipt.file)
     return redirect(url_for("index"))
 
 
-def uniquify(path: str):
-    filename, extension = os.path.splitext(path)
-    counter = 1
-
-    while os.path.exists(path) or database.get_file(os.path.split(path)[1]):
-        path = f"{filename}_{counter}{extension}"
-        counter += 1
-
-    return path
-
-
 @bp.route("/receipt/<int:id>")
 @login_required
 def view_receipt(id: int):
@@ -151,4 +171,28 @@ def get_receipt_document(id: int):
     if receipt is None or not authorized:
         abort(404, "Kvitto hittades ej!")
 
-    return send_from_directory(receipt.file.path, receipt.file.filename)
+    file = receipt.file
+    return send_stored_file(
+        os.path.join(file.path, file.filename), file.mimetype, file.sha256
+    )
+
+
+@bp.route("/receipt/<int:id>/preview/<size>")
+@login_required
+def get_receipt_preview(id: int, size: str):
+    if size not in PREVIEW_SIZES:
+        abort(404)
+    receipt = get_receipt(id)
+    if not receipt:
+        abort(404, "Kvitto hittades ej!")
+
+    owns_receipt = receipt.userId == g.user.id
+    is_cfo = ClearanceEnum.CFO in ClearanceEnum(g.user.userTypeId)
+    authorized = owns_receipt or is_cfo
+    if receipt is None or not authorized:
+        abort(404, "Kvitto hittades ej!")
+
+    path = get_preview(receipt.file, size)
+    if path is None:
+        abort(404, "Förhandsvisning saknas!")
+    return send_stored_file(path, "image/jpeg", f"{receipt.file.sha256}_{size}")
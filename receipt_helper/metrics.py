@@ -0,0 +1,115 @@
+import hmac
+import os
+import time
+
+from flask import Flask, Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import Engine, event
+from sqlalchemy.pool import QueuePool
+
+# prometheus_client keeps the values in per process files under
+# PROMETHEUS_MULTIPROC_DIR if it is set when imported, which the gunicorn
+# config takes care of. /metrics then sums the files of all workers. Only
+# import this module from `create_app` or later, not at package import.
+
+REQUEST_SECONDS = Histogram(
+    "receipts_request_duration_seconds",
+    "Time to handle a request.",
+    ["endpoint", "method"],
+)
+DB_CHECKOUTS = Counter(
+    "receipts_db_checkouts_total", "Connections checked out of the pool."
+)
+DB_CHECKOUT_WAIT_SECONDS = Histogram(
+    "receipts_db_checkout_wait_seconds",
+    "Time spent waiting for a connection from the pool.",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+DB_CONNECTIONS_IN_USE = Gauge(
+    "receipts_db_connections_in_use",
+    "Connections currently checked out of the pool.",
+    multiprocess_mode="livesum",
+)
+RECEIPTS_SUBMITTED = Counter("receipts_submitted_total", "Receipts submitted.")
+RECEIPT_TRANSITIONS = Counter(
+    "receipts_transitions_total",
+    "Receipts approved, rejected, reopened or archived.",
+    ["transition"],
+)
+EMAIL_SEND_SECONDS = Histogram(
+    "receipts_email_send_duration_seconds", "Time to send an email over SMTP."
+)
+EMAIL_FAILURES = Counter("receipts_email_failures_total", "Failed email sends.")
+UPLOAD_BYTES = Counter("receipts_upload_bytes_total", "Bytes of uploaded documents.")
+EXPORT_SECONDS = Histogram(
+    "receipts_export_duration_seconds",
+    "Time to stream a ZIP export to the client.",
+    buckets=(0.5, 1, 5, 15, 30, 60, 120, 300, 600),
+)
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that measures how long checkouts wait for a connection.
+
+    A subclass since the pool has no event before a checkout, and since
+    `Engine.dispose` recreates the pool with the same class.
+    """
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_CHECKOUT_WAIT_SECONDS.observe(time.perf_counter() - started)
+
+
+def configure(app: Flask, engine: Engine):
+    """Measure the requests of `app` and the connection pool of `engine`."""
+
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        DB_CHECKOUTS.inc()
+        DB_CONNECTIONS_IN_USE.inc()
+
+    @event.listens_for(engine, "checkin")
+    def checkin(dbapi_connection, connection_record):
+        DB_CONNECTIONS_IN_USE.dec()
+
+    @app.before_request
+    def start_request():
+        g.request_started = time.perf_counter()
+
+    @app.teardown_request
+    def end_request(exc):
+        started = g.pop("request_started", None)
+        if started is not None:
+            REQUEST_SECONDS.labels(request.endpoint or "none", request.method).observe(
+                time.perf_counter() - started
+            )
+
+
+def has_bearer_token(token: str) -> bool:
+    """Whether the request is authorized with `token` as its bearer token."""
+    scheme, _, given = request.headers.get("Authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(
+        given.strip().encode(), token.encode()
+    )
+
+
+def export() -> Response:
+    """All metrics in the Prometheus text format, summed over all workers."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
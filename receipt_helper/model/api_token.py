@@ -0,0 +1,17 @@
+from datetime import datetime
+
+from sqlalchemy.orm import Mapped, mapped_column
+
+from receipt_helper import db
+
+
+class ApiToken(db.Model):
+    """Bearer token of a service account using the JSON API, see `api`.
+
+    Only the SHA-256 of the token is stored.
+    """
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(unique=True)
+    tokenHash: Mapped[str] = mapped_column(unique=True)
+    created: Mapped[datetime]
@@ -0,0 +1,10 @@
+from sqlalchemy.orm import Mapped, mapped_column
+
+from receipt_helper import db
+
+
+class ChangeCounter(db.Model):
+    """Single row bumped with every change to receipts or users, see `etag`."""
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    value: Mapped[int] = mapped_column(default=0)
@@ -0,0 +1,26 @@
+from datetime import datetime
+
+from sqlalchemy.orm import Mapped, mapped_column
+
+from receipt_helper import db
+from receipt_helper.enums import EmailStatusEnum
+
+
+class OutgoingEmail(db.Model):
+    __table_args__ = (
+        db.Index("ix_outgoing_email_due", "statusId", "nextAttempt"),
+        db.Index("ix_outgoing_email_created", "created", "id"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    recipients: Mapped[str]
+    """Comma separated"""
+    subject: Mapped[str]
+    body: Mapped[str]
+    """Cleared once sent, since it may contain a temporary password."""
+    statusId: Mapped[int] = mapped_column(default=EmailStatusEnum.Queued.value)
+    attempts: Mapped[int] = mapped_column(default=0)
+    created: Mapped[datetime]
+    nextAttempt: Mapped[datetime]
+    sent: Mapped[datetime | None]
+    lastError: Mapped[str | None]
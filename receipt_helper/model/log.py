@@ -15,12 +15,15 @@ class LogType(db.Model):
 
 class Log(db.Model):
     __tablename__ = "Log"
+    # Declared here since the `datetime` attribute shadows its own annotation.
+    __table_args__ = (db.Index("ix_Log_datetime", "datetime"),)
+
     id: Mapped[int] = mapped_column(primary_key=True)
     datetime: Mapped[datetime]
     logTypeId: Mapped[int] = mapped_column(db.ForeignKey(LogType.id))
-    actionBy: Mapped[int] = mapped_column(db.ForeignKey(User.id))
-    receiptId: Mapped[int | None] = mapped_column(db.ForeignKey(Receipt.id))
-    userId: Mapped[int | None] = mapped_column(db.ForeignKey(User.id))
+    actionBy: Mapped[int] = mapped_column(db.ForeignKey(User.id), index=True)
+    receiptId: Mapped[int | None] = mapped_column(db.ForeignKey(Receipt.id), index=True)
+    userId: Mapped[int | None] = mapped_column(db.ForeignKey(User.id), index=True)
     action: Mapped[str]
 
     actionByUser: Mapped[User] = relationship(foreign_keys=[actionBy])
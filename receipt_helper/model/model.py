@@ -1,5 +1,14 @@
+from datetime import UTC, datetime
+
 from flask_sqlalchemy.model import Model
 
+EPOCH = "1970-01-01 00:00:00.000000"
+"""Server default of timestamps set on every write, for rows from before them."""
+
+
+def utcnow() -> datetime:
+    return datetime.now(UTC)
+
 
 class BaseModel(Model):
     def __eq__(self, other):
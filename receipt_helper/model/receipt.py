@@ -4,7 +4,9 @@ from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from receipt_helper import db
 from receipt_helper.enums import ReceiptStatusEnum
+from receipt_helper.model.model import EPOCH, utcnow
 from receipt_helper.model.user import User
+from receipt_helper.storage import document_name
 
 
 class ReceiptStatus(db.Model):
@@ -17,9 +19,24 @@ class File(db.Model):
     id: Mapped[int] = mapped_column(primary_key=True)
     path: Mapped[str]
     filename: Mapped[str] = mapped_column(unique=True)
+    sha256: Mapped[str | None] = mapped_column(index=True, unique=True)
+    """Set for files in the content addressed blob store, see `storage`."""
+    mimetype: Mapped[str | None]
+    size: Mapped[int | None]
 
 
 class Receipt(db.Model):
+    __table_args__ = (
+        db.Index(
+            "ix_receipt_queue",
+            "archived",
+            "statusId",
+            "submit_date",
+            "receipt_date",
+            "id",
+        ),
+    )
+
     id: Mapped[int] = mapped_column(primary_key=True)
     userId: Mapped[int] = mapped_column(db.ForeignKey(User.id))
     receipt_date: Mapped[datetime]
@@ -33,8 +50,40 @@ class Receipt(db.Model):
     statusComment: Mapped[str | None]
     fileId: Mapped[int] = mapped_column(db.ForeignKey(File.id))
     archived: Mapped[bool] = mapped_column(default=False)
+    version: Mapped[int] = mapped_column(default=1, server_default="1")
+    """Bumped on every update, see `receipt_state`."""
+    updated: Mapped[datetime] = mapped_column(
+        default=utcnow, onupdate=utcnow, server_default=EPOCH, index=True
+    )
+    """Time of the last change, for incremental syncs through `api`."""
 
     user: Mapped[User] = relationship()
     status: Mapped[ReceiptStatus] = relationship()
     file: Mapped[File] = relationship()
     logs: Mapped[list["Log"]] = relationship(cascade="all")
+
+    __mapper_args__ = {"version_id_col": version}
+
+    @property
+    def document_name(self) -> str:
+        return document_name(self.receipt_date, self.user.name, self.file.filename)
+
+
+class ReceiptSummary(db.Model):
+    """Count and total of receipts per status, month, activity and user.
+
+    Kept up to date in the same transaction as every receipt insert and
+    status change, see `database.summarize`, so totals are read from here
+    instead of scanning `Receipt`.
+    """
+
+    statusId: Mapped[int] = mapped_column(
+        db.ForeignKey(ReceiptStatus.id), primary_key=True
+    )
+    month: Mapped[str] = mapped_column(primary_key=True)
+    """Month of the receipt date, YYYY-MM."""
+    activity: Mapped[str] = mapped_column(primary_key=True)
+    userId: Mapped[int] = mapped_column(db.ForeignKey(User.id), primary_key=True)
+    count: Mapped[int]
+    amount: Mapped[int]
+    """Pennies"""
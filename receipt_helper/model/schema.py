@@ -0,0 +1,12 @@
+from sqlalchemy.orm import Mapped, mapped_column
+
+from receipt_helper import db
+
+
+class SchemaVersion(db.Model):
+    """Single row recording which migrations have run, see `init_data`."""
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    version: Mapped[int]
+    search_fts: Mapped[bool]
+    """Whether the FTS5 search index could be created."""
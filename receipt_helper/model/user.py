@@ -4,6 +4,7 @@ from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from receipt_helper import db
 from receipt_helper.enums import ClearanceEnum
+from receipt_helper.model.model import EPOCH, utcnow
 from receipt_helper.model.usertype import UserType
 
 
@@ -17,9 +18,10 @@ class User(db.Model):
         db.ForeignKey(UserType.id), default=ClearanceEnum.User.value
     )
     lastLogin: Mapped[datetime | None]
+    updated: Mapped[datetime] = mapped_column(
+        default=utcnow, onupdate=utcnow, server_default=EPOCH, index=True
+    )
+    """Time of the last change, for incremental syncs through `api`."""
 
     userType: Mapped["UserType"] = relationship()
-    logs: Mapped[list["Log"]] = relationship(
-        cascade="all",
-        foreign_keys="Log.userId",
-    )
+    logs: Mapped[list["Log"]] = relationship(foreign_keys="Log.userId")
@@ -0,0 +1,123 @@
+import datetime
+import os
+import smtplib
+import threading
+from typing import Sequence
+
+import click
+from flask import Flask, current_app
+from flask.cli import AppGroup
+
+from receipt_helper import database, metrics
+from receipt_helper.util import SMTPSession, send_email
+
+cli = AppGroup("outbox", help="Send queued emails.")
+
+_wakeup = threading.Event()
+_sender_pid: int | None = None
+_sender_lock = threading.Lock()
+
+
+def queue_email(recipients: str | Sequence[str], subject: str, body: str):
+    """Store an email in the outbox, it is sent by the background sender."""
+    queue_emails([(recipients, subject, body)])
+
+
+def queue_emails(messages: Sequence[tuple[str | Sequence[str], str, str]]):
+    """Store many `(recipients, subject, body)` emails in the outbox at once."""
+    database.queue_emails(
+        [
+            ([recipients] if isinstance(recipients, str) else recipients, subject, body)
+            for recipients, subject, body in messages
+        ]
+    )
+    _wakeup.set()
+
+
+def retry_delay(attempts: int) -> datetime.timedelta | None:
+    """Exponential backoff after `attempts` failures, None once out of attempts."""
+    if attempts >= current_app.config["RECEIPTS_EMAIL_MAX_ATTEMPTS"]:
+        return None
+    delay = current_app.config["RECEIPTS_EMAIL_RETRY_DELAY"] * 2 ** (attempts - 1)
+    return datetime.timedelta(
+        seconds=min(delay, current_app.config["RECEIPTS_EMAIL_MAX_RETRY_DELAY"])
+    )
+
+
+def process_outbox(session: SMTPSession, batch_size: int = 50) -> int:
+    """Send one batch of due emails over `session`.
+
+    Returns the number of emails attempted.
+    """
+    lease = datetime.timedelta(seconds=current_app.config["RECEIPTS_EMAIL_LEASE"])
+    emails = database.claim_due_emails(batch_size, lease)
+    for email in emails:
+        try:
+            with metrics.EMAIL_SEND_SECONDS.time():
+                send_email(
+                    email.recipients.split(","), email.subject, email.body, session
+                )
+        except Exception as ex:
+            # Anything else, like a message that cannot be encoded, is a bug,
+            # but still counts as an attempt so the email ends up Failed.
+            if not isinstance(ex, (smtplib.SMTPException, OSError)):
+                current_app.logger.exception(f"Sending email {email.id} failed")
+            metrics.EMAIL_FAILURES.inc()
+            # Start over with a fresh connection for the next email.
+            session.close()
+            database.mark_email_failed(
+                email, f"{type(ex).__name__}: {ex}", retry_delay(email.attempts + 1)
+            )
+        else:
+            database.mark_email_sent(email)
+    return len(emails)
+
+
+def run_sender(app: Flask, stop: threading.Event | None = None):
+    """Send emails as they become due until `stop` is set."""
+    stop = stop or threading.Event()
+    interval = app.config["RECEIPTS_EMAIL_POLL_INTERVAL"]
+    with SMTPSession.from_config(app.config) as session:
+        while not stop.is_set():
+            _wakeup.clear()
+            try:
+                with app.app_context():
+                    sent = process_outbox(session)
+            except Exception:
+                app.logger.exception("Email sender failed")
+                sent = 0
+            if not sent:
+                session.close_if_idle()
+                _wakeup.wait(min(interval, session.idle_timeout))
+
+
+def start_sender_thread(app: Flask):
+    """Start the background sender in this process, unless already running.
+
+    Keyed on the pid, so a worker forked from a process that already runs a
+    sender starts its own, since threads do not survive a fork.
+    """
+    global _sender_pid
+    with _sender_lock:
+        if _sender_pid == os.getpid():
+            return
+        _sender_pid = os.getpid()
+    threading.Thread(
+        target=run_sender, args=(app,), name="email-sender", daemon=True
+    ).start()
+
+
+@cli.command("run")
+def run_command():
+    """Run the email sender in the foreground."""
+    run_sender(current_app._get_current_object())  # type: ignore
+
+
+@cli.command("flush")
+def flush_command():
+    """Send all emails that are currently due, then exit."""
+    total = 0
+    with SMTPSession.from_config(current_app.config) as session:
+        while sent := process_outbox(session):
+            total += sent
+    click.echo(f"Attempted {total} emails over {session.connects} connections.")
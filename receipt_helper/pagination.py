@@ -0,0 +1,146 @@
+import base64
+import binascii
+import datetime
+import json
+from typing import Any, NamedTuple, Sequence
+
+from sqlalchemy import Select, tuple_
+from sqlalchemy.orm import InstrumentedAttribute
+
+from receipt_helper import db
+
+
+class Page(NamedTuple):
+    items: Sequence[Any]
+    next_cursor: str | None
+    prev_cursor: str | None
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    raw = json.dumps(
+        [
+            v.isoformat() if isinstance(v, (datetime.date, datetime.datetime)) else v
+            for v in values
+        ]
+    )
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_values(cursor: str, count: int) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as ex:
+        raise ValueError(f"Invalid cursor: {cursor}") from ex
+    if not isinstance(values, list) or len(values) != count:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return values
+
+
+def decode_cursor(cursor: str, columns: Sequence[InstrumentedAttribute]) -> list:
+    """Inverse of `encode_cursor`. Raises `ValueError` for malformed cursors.
+
+    Every value is checked against the Python type of its column, so a
+    crafted cursor cannot put anything but a plain value into the query.
+    """
+    values = _decode_values(cursor, len(columns))
+
+    decoded = []
+    for column, value in zip(columns, values):
+        python_type = column.type.python_type
+        if value is None:
+            if not column.expression.nullable:
+                raise ValueError(f"Invalid cursor: {cursor}")
+        elif python_type in (datetime.datetime, datetime.date):
+            if not isinstance(value, str):
+                raise ValueError(f"Invalid cursor: {cursor}")
+            value = python_type.fromisoformat(value)
+        elif type(value) is not python_type:
+            raise ValueError(f"Invalid cursor: {cursor}")
+        decoded.append(value)
+    return decoded
+
+
+def paginate(
+    query: Select,
+    columns: Sequence[InstrumentedAttribute],
+    page_size: int,
+    after: str | None = None,
+    before: str | None = None,
+    descending: bool = False,
+    rows: bool = False,
+) -> Page:
+    """Keyset pagination over `columns`, which must end in a unique column.
+
+    Every page is a single range scan starting at the cursor, so its cost does
+    not depend on how far into the result set it is. With `rows` the page
+    holds `Row`s, for queries selecting columns rather than an entity.
+    """
+    key = tuple_(*columns)
+    order = [c.desc() if descending else c.asc() for c in columns]
+    reverse_order = [c.asc() if descending else c.desc() for c in columns]
+
+    if before is not None:
+        values = decode_cursor(before, columns)
+        cond = key > tuple_(*values) if descending else key < tuple_(*values)
+        query = query.where(cond).order_by(*reverse_order)
+    else:
+        if after is not None:
+            values = decode_cursor(after, columns)
+            cond = key < tuple_(*values) if descending else key > tuple_(*values)
+            query = query.where(cond)
+        query = query.order_by(*order)
+
+    result = db.session.execute(query.limit(page_size + 1))
+    items = list(result if rows else result.unique().scalars())
+    has_more = len(items) > page_size
+    items = items[:page_size]
+
+    def cursor_for(row) -> str:
+        return encode_cursor([getattr(row, c.key) for c in columns])
+
+    if before is not None:
+        items.reverse()
+        next_cursor = cursor_for(items[-1]) if items else None
+        prev_cursor = cursor_for(items[0]) if items and has_more else None
+    else:
+        next_cursor = cursor_for(items[-1]) if items and has_more else None
+        prev_cursor = cursor_for(items[0]) if items and after is not None else None
+
+    return Page(items, next_cursor, prev_cursor)
+
+
+def paginate_offset(
+    query: Select,
+    page_size: int,
+    after: str | None = None,
+    before: str | None = None,
+) -> Page:
+    """Offset pagination, for orders computed per query like search relevance.
+
+    There is no index to seek in for such orders, so unlike `paginate` the
+    cursors hold row offsets. They are just as opaque to the templates.
+    """
+    offset = page_offset(page_size, after, before)
+    rows = list(
+        db.session.execute(query.offset(offset).limit(page_size + 1)).unique().scalars()
+    )
+    next_cursor = encode_cursor([offset + page_size]) if len(rows) > page_size else None
+    prev_cursor = encode_cursor([offset]) if offset > 0 else None
+    return Page(rows[:page_size], next_cursor, prev_cursor)
+
+
+def page_offset(page_size: int, after: str | None, before: str | None) -> int:
+    """Offset of the first row of the page `paginate_offset` returns.
+
+    Lets queries limit the rows they rank to the ones up to the page.
+    """
+    offset = 0
+    cursor = after if after is not None else before
+    if cursor is not None:
+        (offset,) = _decode_values(cursor, 1)
+        if type(offset) is not int or offset < 0:
+            raise ValueError(f"Invalid cursor: {cursor}")
+    if before is not None:
+        offset = max(0, offset - page_size)
+    return offset
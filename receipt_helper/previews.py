@@ -0,0 +1,171 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, current_app
+from PIL import Image, ImageOps
+from pypdf import PageObject, PdfReader
+
+from receipt_helper.model.receipt import File
+from receipt_helper.server_timing import timed
+from receipt_helper.storage import SNIFF_SIZE, reserve_file, sniff_mimetype
+
+PREVIEW_FOLDER = "previews"
+
+PREVIEW_SIZES = {"thumbnail": 240, "preview": 1200}
+"""Longest side in pixels of each preview size."""
+
+SCAN_COVERAGE = 0.5
+"""Share of the first page of a PDF an image has to cover to be its preview."""
+
+_pool: ThreadPoolExecutor | None = None
+_pool_pid: int | None = None
+_pool_lock = threading.Lock()
+
+
+def preview_path(storage_path: str, sha256: str, size: str) -> str:
+    """Where the `size` preview of the blob `sha256` is cached.
+
+    An empty file records that no preview could be made.
+    """
+    return os.path.join(
+        storage_path, PREVIEW_FOLDER, sha256[:2], f"{sha256}_{size}.jpg"
+    )
+
+
+def first_image(path: str, mimetype: str) -> Image.Image | None:
+    """Open the document as an image, for PDFs the largest on the first page.
+
+    Only scanned PDFs, whose first page is mostly an image, have a preview.
+    Others, like documents generated as text with a logo, are rendered by the
+    browser instead.
+    """
+    if mimetype == "application/pdf":
+        page = PdfReader(path).pages[0]
+        if image_coverage(page) < SCAN_COVERAGE:
+            return None
+        return max(
+            (image.image for image in page.images if image.image),
+            key=lambda image: image.width * image.height,
+            default=None,
+        )
+    if mimetype.startswith("image/") and mimetype != "image/svg+xml":
+        return Image.open(path)
+    return None
+
+
+def image_coverage(page: PageObject) -> float:
+    """The largest share of `page` covered by a single image drawn on it."""
+    area = float(page.mediabox.width * page.mediabox.height)
+    largest = 0.0
+
+    def visit(operator, operands, cm, tm):
+        nonlocal largest
+        if operator == b"Do":
+            # Images are drawn into the unit square, scaled by the CTM.
+            largest = max(largest, abs(cm[0] * cm[3] - cm[1] * cm[2]))
+
+    page.extract_text(visitor_operand_before=visit)
+    return largest / area if area else 0.0
+
+
+def render_previews(path: str, mimetype: str | None) -> dict[str, Image.Image]:
+    if mimetype is None:
+        with open(path, "rb") as fd:
+            mimetype = sniff_mimetype(fd.read(SNIFF_SIZE))
+    opened = first_image(path, mimetype)
+    if opened is None:
+        return {}
+
+    with opened:
+        largest = max(PREVIEW_SIZES.values())
+        # Lets JPEG decode at a fraction of the scan's full resolution.
+        opened.draft("RGB", (largest, largest))
+        opened.load()
+        # A copy, so the file can be closed.
+        image = ImageOps.exif_transpose(opened)
+    if image.mode not in ("RGB", "L"):
+        background = Image.new("RGB", image.size, "white")
+        image = image.convert("RGBA")
+        background.paste(image, mask=image)
+        image = background
+
+    previews = {}
+    for size, pixels in sorted(
+        PREVIEW_SIZES.items(), key=lambda item: item[1], reverse=True
+    ):
+        image = image.copy()
+        image.thumbnail((pixels, pixels), Image.Resampling.LANCZOS)
+        previews[size] = image
+    return previews
+
+
+@timed("io")
+def generate_previews(storage_path: str, path: str, sha256: str, mimetype: str | None):
+    """Render and cache all preview sizes of the document at `path`."""
+    try:
+        previews = render_previews(path, mimetype)
+    except Exception:
+        current_app.logger.warning("Could not preview %s", path, exc_info=True)
+        previews = {}
+
+    for size in PREVIEW_SIZES:
+        target = preview_path(storage_path, sha256, size)
+        temp_path, fd = reserve_file(os.path.dirname(target), "preview", ".tmp")
+        with fd:
+            if size in previews:
+                previews[size].save(fd, "JPEG", quality=80, optimize=True)
+        os.replace(temp_path, target)
+
+
+def get_preview(file: File, size: str) -> str | None:
+    """Path of the cached `size` preview of `file`, rendered if missing.
+
+    None if the document has no preview, or is not in the blob store yet.
+    """
+    if file.sha256 is None:
+        return None
+    storage_path = current_app.config["RECEIPTS_STORAGE_PATH"]
+    target = preview_path(storage_path, file.sha256, size)
+    if not os.path.exists(target):
+        generate_previews(
+            storage_path,
+            os.path.join(file.path, file.filename),
+            file.sha256,
+            file.mimetype,
+        )
+    return target if os.path.getsize(target) else None
+
+
+def _generate_in_background(app: Flask, *args):
+    with app.app_context():
+        generate_previews(*args)
+
+
+def schedule_previews(file: File):
+    """Render the previews of `file` in the background worker pool."""
+    global _pool, _pool_pid
+    if file.sha256 is None:
+        return
+    storage_path = current_app.config["RECEIPTS_STORAGE_PATH"]
+    if all(
+        os.path.exists(preview_path(storage_path, file.sha256, size))
+        for size in PREVIEW_SIZES
+    ):
+        return
+    with _pool_lock:
+        # Threads do not survive a fork, a forked worker needs its own pool.
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(
+                max_workers=current_app.config["RECEIPTS_PREVIEW_WORKERS"],
+                thread_name_prefix="preview",
+            )
+            _pool_pid = os.getpid()
+    _pool.submit(
+        _generate_in_background,
+        current_app._get_current_object(),  # type: ignore
+        storage_path,
+        os.path.join(file.path, file.filename),
+        file.sha256,
+        file.mimetype,
+    )
@@ -0,0 +1,237 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, NamedTuple, Sequence
+
+from flask import current_app
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.exc import StaleDataError
+
+from receipt_helper import database, metrics
+from receipt_helper.enums import LogTypeEnum, ReceiptStatusEnum
+from receipt_helper.model.receipt import Receipt
+from receipt_helper.server_timing import timed
+from receipt_helper.storage import browse_path
+
+
+class TransitionError(Exception):
+    """The transition is not allowed, or the receipt changed underneath it."""
+
+
+class Transition(NamedTuple):
+    sources: tuple[ReceiptStatusEnum, ...] | None
+    """Statuses the transition can start from, None for any."""
+    target: ReceiptStatusEnum | None
+    """Status after the transition, None to keep the current one."""
+    action: str
+
+
+TRANSITIONS = {
+    "approve": Transition(
+        (ReceiptStatusEnum.Pending,), ReceiptStatusEnum.Handled, "kvitto godkänt"
+    ),
+    "reject": Transition(
+        (ReceiptStatusEnum.Pending,), ReceiptStatusEnum.Rejected, "kvitto nekat"
+    ),
+    "reopen": Transition(
+        (ReceiptStatusEnum.Handled, ReceiptStatusEnum.Rejected),
+        ReceiptStatusEnum.Pending,
+        "kvitto pågående",
+    ),
+    "archive": Transition(None, None, "kvitto arkiverat"),
+}
+
+
+def apply(
+    receipt: Receipt,
+    name: str,
+    actionBy: int,
+    reason: str | None = None,
+    version: int | None = None,
+):
+    """Apply the transition `name` to `receipt` as a single unit of work.
+
+    The status change, its log entry and the update of the receipt summary
+    are committed together. Documents in the blob store stay where they are,
+    only files stored before it are moved to the folder of their new status,
+    and moved back if the commit fails.
+    `Receipt.version` is checked both against `version`, the version the
+    caller acted on, and by the UPDATE itself, so two concurrent transitions
+    of the same receipt cannot both succeed.
+    """
+    transition = TRANSITIONS[name]
+    if version is not None and receipt.version != version:
+        raise TransitionError("Kvittot har ändrats, försök igen!")
+    if transition.sources is not None and receipt.statusId not in transition.sources:
+        raise TransitionError("Kvittot har redan hanterats!")
+
+    moved = None
+    if transition.target is not None and receipt.file.sha256 is None:
+        moved = move_legacy_document(receipt, transition.target)
+
+    try:
+        if transition.target is not None:
+            database.summarize(receipt, -1)
+            receipt.statusId = transition.target.value
+            receipt.statusComment = reason
+            # Flushes the versioned UPDATE of the receipt.
+            database.summarize(receipt, 1)
+        if name == "archive":
+            receipt.archived = True
+        database.bump_changes()
+        database.add(
+            database.make_log(
+                transition.action, LogTypeEnum.CFO, actionBy, receipt=receipt.id
+            )
+        )
+        database.commit()
+    except BaseException as ex:
+        database.rollback()
+        if moved is not None:
+            shutil.move(*moved)
+        if isinstance(ex, StaleDataError):
+            raise TransitionError("Kvittot har ändrats, försök igen!") from ex
+        raise
+    metrics.RECEIPT_TRANSITIONS.labels(name).inc()
+
+
+def apply_many(
+    versions: dict[int, int],
+    name: str,
+    actionBy: int,
+    reason: str | None = None,
+    check: Callable[[Receipt], bool] | None = None,
+) -> Sequence[Receipt]:
+    """Apply the transition `name` to many receipts as a single unit of work.
+
+    `versions` maps the id of every receipt to the version the caller acted
+    on. Receipts that have changed since, cannot make the transition or fail
+    `check` are skipped. The rest are changed by one UPDATE, and summarized
+    and logged in batches, all in one commit. Documents outside the blob
+    store are moved in a thread pool first, and moved back if it fails.
+    Returns the changed receipts, with their submitter loaded.
+    """
+    transition = TRANSITIONS[name]
+    receipts = [
+        receipt
+        for receipt in database.get_receipts(
+            versions, (joinedload(Receipt.file), joinedload(Receipt.user))
+        )
+        if receipt.version == versions[receipt.id]
+        and (transition.sources is None or receipt.statusId in transition.sources)
+        and (check is None or check(receipt))
+    ]
+
+    moves = {}
+    if transition.target is not None:
+        for receipt in receipts:
+            if receipt.file.sha256 is None:
+                move = legacy_move(receipt, transition.target)
+                if move is not None:
+                    moves[receipt.id] = move
+    moved = move_documents(moves)
+    # The documents that were already gone have been moved by someone else.
+    receipts = [r for r in receipts if r.id not in moves or r.id in moved]
+
+    values: dict = {}
+    if transition.target is not None:
+        values.update(statusId=transition.target.value, statusComment=reason)
+    if name == "archive":
+        values.update(archived=True)
+
+    try:
+        updated = set(
+            database.update_receipts({r.id: r.version for r in receipts}, **values)
+        )
+        receipts = [r for r in receipts if r.id in updated]
+        if transition.target is not None:
+            database.summarize_many(receipts, -1)
+            database.summarize_many(receipts, 1, transition.target.value)
+        for receipt in receipts:
+            if receipt.id in moved:
+                receipt.file.path = os.path.dirname(moved[receipt.id][1])
+        database.add_all(
+            database.make_log(
+                transition.action, LogTypeEnum.CFO, actionBy, receipt=receipt.id
+            )
+            for receipt in receipts
+        )
+        database.commit()
+    except BaseException:
+        database.rollback()
+        move_documents({id: (dst, src) for id, (src, dst) in moved.items()})
+        raise
+    move_documents(
+        {id: (dst, src) for id, (src, dst) in moved.items() if id not in updated}
+    )
+    metrics.RECEIPT_TRANSITIONS.labels(name).inc(len(updated))
+
+    return database.get_receipts(updated, (selectinload(Receipt.user),))
+
+
+def legacy_move(receipt: Receipt, status: ReceiptStatusEnum) -> tuple[str, str] | None:
+    """`(source, destination)` of a document stored outside the blob store.
+
+    The destination is in the folder of `status`, None if it is already there.
+    """
+    file = receipt.file
+    path = os.path.join(
+        current_app.config["RECEIPTS_STORAGE_PATH"],
+        browse_path(status, receipt.receipt_date, receipt.submit_date),
+    )
+    source = os.path.join(file.path, file.filename)
+    destination = os.path.join(path, file.filename)
+    return None if source == destination else (source, destination)
+
+
+@timed("io")
+def move_legacy_document(
+    receipt: Receipt, status: ReceiptStatusEnum
+) -> tuple[str, str] | None:
+    """Move a document stored outside the blob store to the folder of `status`.
+
+    Returns the `(source, destination)` needed to move it back, if it moved.
+    """
+    move = legacy_move(receipt, status)
+    if move is None:
+        return None
+    source, destination = move
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    try:
+        shutil.move(source, destination)
+    except FileNotFoundError as ex:
+        # Another request moved it first.
+        database.rollback()
+        raise TransitionError("Kvittot har ändrats, försök igen!") from ex
+    receipt.file.path = os.path.dirname(destination)
+    return destination, source
+
+
+def _move(move: tuple[str, str]) -> OSError | None:
+    source, destination = move
+    try:
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.move(source, destination)
+    except OSError as ex:
+        return ex
+    return None
+
+
+@timed("io")
+def move_documents(moves: dict[int, tuple[str, str]]) -> dict[int, tuple[str, str]]:
+    """Make the `(source, destination)` moves by receipt id in a thread pool.
+
+    Returns the moves that were made. Documents that are already gone are
+    skipped, any other error moves the rest back and is raised.
+    """
+    if not moves:
+        return {}
+    workers = min(len(moves), current_app.config["RECEIPTS_FILE_WORKERS"])
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        errors = dict(zip(moves, pool.map(_move, moves.values())))
+    moved = {id: moves[id] for id, error in errors.items() if error is None}
+    for error in errors.values():
+        if error is not None and not isinstance(error, FileNotFoundError):
+            move_documents({id: (dst, src) for id, (src, dst) in moved.items()})
+            raise error
+    return moved
@@ -0,0 +1,168 @@
+import functools
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from flask import Flask, Response, before_render_template, g, request, template_rendered
+from sqlalchemy import Engine, event
+
+MAX_QUERIES = 500
+"""Statements kept per request for the slow request log."""
+
+_current: ContextVar["RequestTimings | None"] = ContextVar(
+    "request_timings", default=None
+)
+
+
+@dataclass
+class RequestTimings:
+    """What a request spent its time on, in seconds.
+
+    `durations` holds the time per category: "db" for SQL, "render" for
+    templates excluding their SQL, "render-db" for the SQL of lazy loads in
+    templates, and "io" and "smtp" for the functions marked with `timed`.
+    """
+
+    started: float = field(default_factory=time.perf_counter)
+    durations: dict[str, float] = field(default_factory=dict)
+    query_count: int = 0
+    queries: list[tuple[float, str]] = field(default_factory=list)
+    slowest: tuple[float, str] | None = None
+    active: set[str] = field(default_factory=set)
+    render_started: list[tuple[float, float]] = field(default_factory=list)
+
+    def add(self, name: str, seconds: float):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def add_query(self, seconds: float, statement: str):
+        self.add("db", seconds)
+        self.query_count += 1
+        if len(self.queries) < MAX_QUERIES:
+            self.queries.append((seconds, statement))
+        if self.slowest is None or seconds > self.slowest[0]:
+            self.slowest = (seconds, statement)
+
+    @property
+    def total(self) -> float:
+        return time.perf_counter() - self.started
+
+    def header(self) -> str:
+        metrics = [f'db;dur={self.ms("db"):.1f};desc="{self.query_count} queries"']
+        for name in ("render", "render-db", "io", "smtp"):
+            if name in self.durations:
+                metrics.append(f"{name};dur={self.ms(name):.1f}")
+        metrics.append(f"total;dur={self.total * 1000:.1f}")
+        return ", ".join(metrics)
+
+    def ms(self, name: str) -> float:
+        return self.durations.get(name, 0.0) * 1000
+
+
+def timed(name: str):
+    """Count the time spent in the decorated function as `name`.
+
+    Free outside instrumented requests. Nested calls are only counted once.
+    """
+
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            timings = _current.get()
+            if timings is None or name in timings.active:
+                return f(*args, **kwargs)
+            timings.active.add(name)
+            started = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                timings.active.discard(name)
+                timings.add(name, time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+def configure(app: Flask, engine: Engine):
+    """Time every request, if RECEIPTS_SERVER_TIMING is set.
+
+    The timings are sent in a Server-Timing header and logged, along with all
+    statements if the request took over RECEIPTS_SLOW_REQUEST_MS. The body
+    of a streamed response is sent after this, and is not included.
+    """
+    if not app.config["RECEIPTS_SERVER_TIMING"]:
+        return
+    slow = app.config["RECEIPTS_SLOW_REQUEST_MS"] / 1000
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info["query_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        timings = _current.get()
+        started = conn.info.pop("query_started", None)
+        if timings is not None and started is not None:
+            timings.add_query(time.perf_counter() - started, statement)
+
+    @before_render_template.connect_via(app)
+    def start_render(sender, template, context, **extra):
+        timings = _current.get()
+        if timings is not None:
+            timings.render_started.append(
+                (time.perf_counter(), timings.durations.get("db", 0.0))
+            )
+
+    @template_rendered.connect_via(app)
+    def end_render(sender, template, context, **extra):
+        timings = _current.get()
+        if timings is None or not timings.render_started:
+            return
+        started, db_before = timings.render_started.pop()
+        if timings.render_started:
+            # Included templates are counted by the outermost one.
+            return
+        db = timings.durations.get("db", 0.0) - db_before
+        timings.add("render", time.perf_counter() - started - db)
+        timings.add("render-db", db)
+
+    @app.before_request
+    def start_request():
+        g.request_timings = _current.set(RequestTimings())
+
+    @app.after_request
+    def end_request(response: Response) -> Response:
+        timings = _current.get()
+        if timings is None:
+            return response
+        response.headers["Server-Timing"] = timings.header()
+        log_request(app, timings, response, slow)
+        return response
+
+    @app.teardown_request
+    def reset(exc):
+        token = g.pop("request_timings", None)
+        if token is not None:
+            _current.reset(token)
+
+
+def log_request(app: Flask, timings: RequestTimings, response: Response, slow: float):
+    total = timings.total
+    slowest_ms, slowest = timings.slowest or (0.0, "")
+    message = (
+        f"method={request.method} path={request.path} status={response.status_code}"
+        f" total_ms={total * 1000:.1f} queries={timings.query_count}"
+        f" db_ms={timings.ms('db'):.1f} render_ms={timings.ms('render'):.1f}"
+        f" render_db_ms={timings.ms('render-db'):.1f} io_ms={timings.ms('io'):.1f}"
+        f" smtp_ms={timings.ms('smtp'):.1f} slowest_ms={slowest_ms * 1000:.1f}"
+        f" slowest={' '.join(slowest.split())[:200]!r}"
+    )
+    if total < slow:
+        app.logger.info(f"request {message}")
+        return
+    statements = "".join(
+        f"\n  {seconds * 1000:8.1f} ms  {' '.join(statement.split())}"
+        for seconds, statement in timings.queries
+    )
+    app.logger.warning(f"slow request {message}{statements}")
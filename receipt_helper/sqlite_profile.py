@@ -0,0 +1,83 @@
+import os
+import re
+import threading
+
+from flask import Flask
+from sqlalchemy import Engine, event
+
+# Pragma name and the config key its value is read from.
+PRAGMAS = {
+    "journal_mode": "RECEIPTS_SQLITE_JOURNAL_MODE",
+    "synchronous": "RECEIPTS_SQLITE_SYNCHRONOUS",
+    "busy_timeout": "RECEIPTS_SQLITE_BUSY_TIMEOUT",
+    "mmap_size": "RECEIPTS_SQLITE_MMAP_SIZE",
+    "cache_size": "RECEIPTS_SQLITE_CACHE_SIZE",
+    "foreign_keys": "RECEIPTS_SQLITE_FOREIGN_KEYS",
+    "temp_store": "RECEIPTS_SQLITE_TEMP_STORE",
+}
+PRAGMA_VALUE = re.compile(r"^-?\w+$")
+
+_maintenance_pid: int | None = None
+_maintenance_lock = threading.Lock()
+
+
+def configure(app: Flask, engine: Engine):
+    """Apply the SQLite pragmas of `app.config` to every new connection."""
+    pragmas = {}
+    for pragma, key in PRAGMAS.items():
+        value = str(app.config[key])
+        if not PRAGMA_VALUE.match(value):
+            raise ValueError(f"Invalid {key}: {value}")
+        pragmas[pragma] = value
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+        cursor.close()
+
+
+def start_maintenance_thread(app: Flask, engine: Engine):
+    """Start `run_maintenance` in this process, unless already running or
+    turned off with RECEIPTS_SQLITE_MAINTENANCE_INTERVAL.
+
+    Keyed on the pid, since threads do not survive a fork.
+    """
+    global _maintenance_pid
+    interval = app.config["RECEIPTS_SQLITE_MAINTENANCE_INTERVAL"]
+    if not interval:
+        return
+    with _maintenance_lock:
+        if _maintenance_pid == os.getpid():
+            return
+        _maintenance_pid = os.getpid()
+    threading.Thread(
+        target=run_maintenance,
+        args=(app, engine, interval),
+        name="sqlite-maintenance",
+        daemon=True,
+    ).start()
+
+
+def run_maintenance(app: Flask, engine: Engine, interval: float):
+    """Every `interval` seconds, update the query planner statistics and
+    checkpoint the WAL so it does not grow while readers keep it busy."""
+    stop = threading.Event()
+    while not stop.wait(interval):
+        try:
+            with engine.connect() as conn:
+                conn.exec_driver_sql("PRAGMA optimize")
+                conn.exec_driver_sql("PRAGMA wal_checkpoint(PASSIVE)")
+        except Exception:
+            app.logger.exception("SQLite maintenance failed")
+
+
+def describe(engine: Engine) -> str:
+    """The pragmas in effect on a connection of `engine`."""
+    with engine.connect() as conn:
+        values = {
+            pragma: conn.exec_driver_sql(f"PRAGMA {pragma}").scalar()
+            for pragma in PRAGMAS
+        }
+    return "SQLite " + ", ".join(f"{key}={value}" for key, value in values.items())
@@ -0,0 +1,234 @@
+import datetime
+import hashlib
+import mimetypes
+import os
+import secrets
+from contextlib import suppress
+from typing import BinaryIO
+from urllib.parse import quote
+
+from flask import Request, Response, current_app, request, send_file
+from werkzeug.utils import secure_filename
+
+from receipt_helper.enums import STATUS_FOLDER_MAP, ReceiptStatusEnum
+from receipt_helper.server_timing import timed
+
+BLOB_FOLDER = "blobs"
+TMP_FOLDER = "tmp"
+CHUNK_SIZE = 64 * 1024
+SNIFF_SIZE = 512
+MAX_AGE = 24 * 60 * 60
+
+MAGIC_NUMBERS = (
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+)
+# Only these are served inline. Anything else, SVG with its scripts included,
+# is downloaded as an attachment.
+INLINE_MIMETYPES = {mimetype for _, mimetype in MAGIC_NUMBERS} | {"image/webp"}
+
+
+def reserve_file(
+    directory: str, name: str, extension: str, mode: str = "wb"
+) -> tuple[str, BinaryIO]:
+    """Create a new empty file named after `name` with a random suffix.
+
+    The file is created with O_EXCL, so the name is reserved atomically even
+    across processes, and the 32 bit suffix makes a retry very unlikely.
+    Returns the path and the file opened for writing.
+    """
+    os.makedirs(directory, exist_ok=True)
+    while True:
+        filename = secure_filename(f"{name}_{secrets.token_hex(4)}{extension}")
+        path = os.path.join(directory, filename)
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            continue
+        return path, os.fdopen(fd, mode)
+
+
+@timed("io")
+def hash_file(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as fd:
+        while chunk := fd.read(CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def sniff_mimetype(head: bytes) -> str:
+    """Detect the type of a document from its first bytes.
+
+    Only the raster and PDF types the upload form allows are recognized,
+    anything else is `application/octet-stream`.
+    """
+    for magic, mimetype in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return mimetype
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+class UploadFile:
+    """Temporary file an upload is streamed into.
+
+    The content hash, size and type are computed while the body is written,
+    so the upload is never read back. Unless `store` moves it into the blob
+    store, the file is removed when closed at the end of the request.
+    """
+
+    def __init__(self, directory: str):
+        self.path, self._file = reserve_file(directory, "upload", "", "w+b")
+        self.size = 0
+        self.stored = False
+        self._sha256 = hashlib.sha256()
+        self._head = b""
+
+    def write(self, data: bytes) -> int:
+        if len(self._head) < SNIFF_SIZE:
+            self._head += data[: SNIFF_SIZE - len(self._head)]
+        self._sha256.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self) -> str:
+        return self._sha256.hexdigest()
+
+    @property
+    def mimetype(self) -> str:
+        return sniff_mimetype(self._head)
+
+    def store(self, storage_path: str, extension: str) -> tuple[str, str]:
+        """Move the upload into the blob store, see `store_blob`."""
+        self._file.close()
+        self.stored = True
+        return store_blob(storage_path, self.path, self.sha256, extension)
+
+    def close(self):
+        self._file.close()
+        if not self.stored:
+            with suppress(FileNotFoundError):
+                os.remove(self.path)
+
+    def __getattr__(self, name: str):
+        return getattr(self._file, name)
+
+
+class UploadRequest(Request):
+    """Request that streams uploaded files to the storage volume.
+
+    Werkzeug would otherwise spool them in memory or the system temp folder,
+    and they would have to be copied again to reach the storage volume.
+    """
+
+    def _get_file_stream(
+        self,
+        total_content_length: int | None,
+        content_type: str | None,
+        filename: str | None = None,
+        content_length: int | None = None,
+    ) -> UploadFile:
+        return UploadFile(
+            os.path.join(current_app.config["RECEIPTS_STORAGE_PATH"], TMP_FOLDER)
+        )
+
+
+def blob_location(storage_path: str, sha256: str, extension: str) -> tuple[str, str]:
+    """The `(path, filename)` of the blob with content hash `sha256`."""
+    return (
+        os.path.join(storage_path, BLOB_FOLDER, sha256[:2]),
+        f"{sha256}{extension.lower()}",
+    )
+
+
+@timed("io")
+def store_blob(
+    storage_path: str, source: str, sha256: str, extension: str
+) -> tuple[str, str]:
+    """Move the file at `source` into the blob store.
+
+    Blobs are named by their content, so if two processes store the same
+    content at once, either rename leaves the right bytes in place.
+    Returns the `(path, filename)` of the blob.
+    """
+    path, filename = blob_location(storage_path, sha256, extension)
+    os.makedirs(path, exist_ok=True)
+    os.replace(source, os.path.join(path, filename))
+    return path, filename
+
+
+def browse_path(
+    status: int, receipt_date: datetime.datetime, submit_date: datetime.datetime
+) -> str:
+    """Folder a receipt is listed under when browsing by status and date."""
+    status = ReceiptStatusEnum(status)
+    date = submit_date if status == ReceiptStatusEnum.Pending else receipt_date
+    return os.path.join(STATUS_FOLDER_MAP[status], date.date().isoformat())
+
+
+def document_name(
+    receipt_date: datetime.datetime, user_name: str, filename: str
+) -> str:
+    """Human readable name for a receipt document."""
+    extension = os.path.splitext(filename)[1]
+    return secure_filename(f"{receipt_date.date().isoformat()}_{user_name}{extension}")
+
+
+def send_stored_file(path: str, mimetype: str | None, etag: str | None) -> Response:
+    """Send a stored file, privately cacheable and with range support.
+
+    Pass the content hash as `etag` for files that never change, a request
+    that already has them is then answered without touching the file. If
+    RECEIPTS_ACCEL_REDIRECT is set, the bytes are left to the front proxy
+    through X-Accel-Redirect, and Flask's USE_X_SENDFILE works as usual.
+    Types not in INLINE_MIMETYPES are sent as attachments, and browsers are
+    told not to second-guess the type of any file.
+    """
+    mimetype = mimetype or mimetypes.guess_type(path)[0]
+    attachment = mimetype not in INLINE_MIMETYPES
+    if attachment:
+        mimetype = "application/octet-stream"
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+    else:
+        response = _send_file(path, mimetype, etag)
+    if attachment:
+        response.headers.set(
+            "Content-Disposition", "attachment", filename=os.path.basename(path)
+        )
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    response.cache_control.no_cache = None
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.max_age = MAX_AGE
+    return response
+
+
+@timed("io")
+def _send_file(path: str, mimetype: str, etag: str | None) -> Response:
+    prefix = current_app.config["RECEIPTS_ACCEL_REDIRECT"]
+    relative = os.path.relpath(path, current_app.config["RECEIPTS_STORAGE_PATH"])
+    if not prefix or relative.startswith(os.pardir):
+        response = send_file(
+            path, mimetype=mimetype, etag=etag or True, conditional=True
+        )
+        # pdf.js only fetches in ranges when told it can.
+        response.accept_ranges = "bytes"
+        return response
+
+    response = Response(mimetype=mimetype)
+    response.headers["X-Accel-Redirect"] = (
+        f"{prefix.rstrip('/')}/{quote(relative.replace(os.sep, '/'))}"
+    )
+    if etag is not None:
+        response.set_etag(etag)
+    return response
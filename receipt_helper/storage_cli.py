@@ -0,0 +1,85 @@
+import os
+import secrets
+import shutil
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from receipt_helper import database
+from receipt_helper.storage import (
+    browse_path,
+    document_name,
+    hash_file,
+    store_blob,
+)
+
+cli = AppGroup("storage", help="Manage stored receipt documents.")
+
+
+@cli.command("migrate")
+def migrate_command():
+    """Move documents stored in status folders into the blob store."""
+    storage_path = current_app.config["RECEIPTS_STORAGE_PATH"]
+    moved = merged = missing = 0
+    for file in database.get_legacy_files():
+        source = os.path.join(file.path, file.filename)
+        if not os.path.exists(source):
+            click.echo(f"Missing: {source}", err=True)
+            missing += 1
+            continue
+        sha256 = hash_file(source)
+        existing = database.get_file_by_hash(sha256)
+        if existing:
+            database.replace_file(file, existing)
+            os.remove(source)
+            merged += 1
+            continue
+        extension = os.path.splitext(file.filename)[1]
+        file.path, file.filename = store_blob(storage_path, source, sha256, extension)
+        file.sha256 = sha256
+        database.commit()
+        moved += 1
+    click.echo(f"Moved {moved}, merged {merged} duplicates, {missing} missing.")
+
+
+@cli.command("materialize")
+@click.argument("destination", required=False)
+def materialize_command(destination: str | None):
+    """Build a browsable status/date folder tree of links to the documents.
+
+    Defaults to a by_status folder in the storage path. The tree is built
+    next to DESTINATION and swapped in when complete.
+    """
+    storage_path = current_app.config["RECEIPTS_STORAGE_PATH"]
+    destination = destination or os.path.join(storage_path, "by_status")
+    building = f"{destination}.{secrets.token_hex(4)}"
+
+    count = 0
+    for row in database.get_export_files():
+        folder = os.path.join(
+            building, browse_path(row.statusId, row.receipt_date, row.submit_date)
+        )
+        os.makedirs(folder, exist_ok=True)
+        target = os.path.join(
+            folder,
+            f"{row.id}_{document_name(row.receipt_date, row.name, row.filename)}",
+        )
+        source = os.path.join(row.path, row.filename)
+        try:
+            os.link(source, target)
+        except FileNotFoundError:
+            click.echo(f"Missing: {source}", err=True)
+            continue
+        except OSError:
+            # Different file system, or no hard links.
+            os.symlink(os.path.abspath(source), target)
+        count += 1
+
+    os.makedirs(building, exist_ok=True)
+    old = f"{building}.old"
+    if os.path.exists(destination):
+        os.rename(destination, old)
+    os.rename(building, destination)
+    shutil.rmtree(old, ignore_errors=True)
+    click.echo(f"Linked {count} documents into {destination}.")
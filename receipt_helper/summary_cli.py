@@ -0,0 +1,29 @@
+import click
+from flask.cli import AppGroup
+
+from receipt_helper import database
+
+cli = AppGroup("summary", help="Maintain the receipt totals of the CFO dashboard.")
+
+
+@cli.command("rebuild")
+def rebuild_command():
+    """Recompute the receipt summary from scratch, then verify it."""
+    database.rebuild_summary()
+    click.echo("Rebuilt the receipt summary.")
+    verify()
+
+
+@cli.command("verify")
+def verify_command():
+    """Check the receipt summary against a recount of all receipts."""
+    verify()
+
+
+def verify():
+    mismatches = database.get_summary_mismatches()
+    for key, expected, actual in mismatches:
+        click.echo(f"{key}: expected {expected}, found {actual}", err=True)
+    if mismatches:
+        raise click.ClickException(f"{len(mismatches)} summary rows are wrong.")
+    click.echo("The receipt summary is correct.")
@@ -0,0 +1,135 @@
+import csv
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Iterable
+from uuid import uuid4
+
+from flask import current_app, url_for
+from werkzeug.datastructures import MultiDict
+from werkzeug.security import generate_password_hash
+
+from receipt_helper import database
+from receipt_helper.enums import ClearanceEnum
+from receipt_helper.forms.user_forms import AddSingleUserForm
+from receipt_helper.model.user import User
+from receipt_helper.outbox import queue_emails
+
+# Below this many rows, starting worker processes costs more than it saves.
+PROCESS_POOL_THRESHOLD = 16
+
+
+class ImportRow:
+    """One line of an import file and what happened to it."""
+
+    def __init__(self, line: int, name: str, email: str):
+        self.line = line
+        self.name = name
+        self.email = email
+        self.added = False
+        self.message = ""
+
+
+def account_created_email(email: str, temp_password: str) -> tuple[str, str, str]:
+    return (
+        email,
+        "Konto för kvittoredovisning skapat!",
+        f"""Hej
+
+Det har skapats ett konto åt dig för att kunna hantera kvittoredovisningar. Inloggningsuppgifter står nedan.
+
+Länk: {url_for('main.index', _external=True)}
+Användarnamn: {email}
+Lösenord: {temp_password}
+
+Ovanstående lösenord är temporärt och vid första inloggning kommer du behöva byta ditt lösenord.
+""",
+    )
+
+
+def read_rows(stream: IO[bytes]) -> list[ImportRow]:
+    """Parse and validate an uploaded CSV of `name,email` lines."""
+    reader = csv.DictReader(
+        io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""),
+        fieldnames=["name", "email"],
+    )
+    rows = []
+    seen = set()
+    for line, row in enumerate(reader, start=1):
+        form = AddSingleUserForm(
+            MultiDict({k: v or "" for k, v in row.items() if k}), meta={"csrf": False}
+        )
+        valid = form.validate()
+        import_row = ImportRow(
+            line, form.name.data or "", (form.email.data or "").lower()
+        )
+        if not valid:
+            import_row.message = "; ".join(
+                error for errors in form.errors.values() for error in errors
+            )
+        elif import_row.email in seen:
+            import_row.message = "Förekommer flera gånger i filen"
+        seen.add(import_row.email)
+        rows.append(import_row)
+    return rows
+
+
+def hash_passwords(passwords: list[str]) -> Iterable[str]:
+    """Hash `passwords` in parallel, the KDF is deliberately slow."""
+    workers = current_app.config["RECEIPTS_IMPORT_HASH_WORKERS"] or os.cpu_count() or 1
+    if workers == 1 or len(passwords) < PROCESS_POOL_THRESHOLD:
+        return [generate_password_hash(password) for password in passwords]
+    # Spawned rather than forked, forking a threaded web worker is unsafe.
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        return list(
+            pool.map(
+                generate_password_hash,
+                passwords,
+                chunksize=max(1, len(passwords) // (workers * 4)),
+            )
+        )
+
+
+def import_users(rows: list[ImportRow], action_by: int) -> bool:
+    """Create accounts for all valid rows that do not already exist.
+
+    The users and their log entries are inserted in one transaction, and the
+    welcome emails are queued in the outbox afterwards.
+    """
+    pending = [row for row in rows if not row.message]
+    existing = database.get_existing_emails([row.email for row in pending])
+    for row in pending:
+        if row.email in existing:
+            row.message = "Användaren finns redan"
+    pending = [row for row in pending if not row.message]
+    if not pending:
+        return True
+
+    passwords = [str(uuid4()) for _ in pending]
+    users = [
+        User(
+            email=row.email,
+            name=row.name,
+            password=hashed,
+            userTypeId=ClearanceEnum.User.value,
+        )  # type: ignore
+        for row, hashed in zip(pending, hash_passwords(passwords))
+    ]
+    if not database.add_users(users, "användare tillagd", action_by):
+        for row in pending:
+            row.message = "Fel vid skapandet av kontot"
+        return False
+
+    for row in pending:
+        row.added = True
+        row.message = "Tillagd"
+    queue_emails(
+        [
+            account_created_email(row.email, password)
+            for row, password in zip(pending, passwords)
+        ]
+    )
+    return True
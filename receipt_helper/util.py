@@ -1,31 +1,122 @@
 import smtplib
+import time
 from email.message import EmailMessage
 from typing import Sequence
 
 from flask import current_app
 
+from receipt_helper.server_timing import timed
 
-def send_email(recipients: str | Sequence[str], subject: str, body: str):
+
+class SMTPSession:
+    """An authenticated SMTP connection that is reused for many messages.
+
+    The connection is opened on the first send, reopened if the server has
+    dropped it, and closed by `close_if_idle` once it has not been used for
+    `idle_timeout` seconds. Not thread safe, use one session per thread.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int | str | None,
+        username: str | None = None,
+        password: str | None = None,
+        starttls: bool = True,
+        idle_timeout: float = 60,
+    ):
+        self.host = host
+        self.port = int(port) if port else 0
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.idle_timeout = idle_timeout
+        self.connects = 0
+        self._smtp: smtplib.SMTP | None = None
+        self._last_used = 0.0
+
+    @classmethod
+    def from_config(cls, config) -> "SMTPSession":
+        return cls(
+            config["RECEIPTS_SMTP_HOST"],
+            config["RECEIPTS_SMTP_PORT"],
+            config["RECEIPTS_SMTP_USERNAME"],
+            config["RECEIPTS_SMTP_PASSWORD"],
+            starttls=config["RECEIPTS_SMTP_STARTTLS"],
+            idle_timeout=config["RECEIPTS_SMTP_IDLE_TIMEOUT"],
+        )
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(self.host, port=self.port)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password or "")
+        except BaseException:
+            smtp.close()
+            raise
+        self.connects += 1
+        return smtp
+
+    @timed("smtp")
+    def send(self, msg: EmailMessage, to_addrs: Sequence[str]):
+        if self._smtp is not None and self._idle_for() > self.idle_timeout:
+            self.close()
+        if self._smtp is None:
+            self._smtp = self._connect()
+        try:
+            self._smtp.send_message(msg, to_addrs=to_addrs)
+        except smtplib.SMTPServerDisconnected:
+            # The server closed the connection since the last message.
+            self.close()
+            self._smtp = self._connect()
+            self._smtp.send_message(msg, to_addrs=to_addrs)
+        self._last_used = time.monotonic()
+
+    def _idle_for(self) -> float:
+        return time.monotonic() - self._last_used
+
+    def close_if_idle(self):
+        if self._smtp is not None and self._idle_for() > self.idle_timeout:
+            self.close()
+
+    def close(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self._smtp.close()
+        self._smtp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def send_email(
+    recipients: str | Sequence[str],
+    subject: str,
+    body: str,
+    session: SMTPSession | None = None,
+):
     msg = EmailMessage()
     msg.set_content(body)
     msg["Subject"] = subject
     msg["From"] = current_app.config["RECEIPTS_EMAIL_SENDER"]
     if isinstance(recipients, str):
-        msg["To"] = recipients
-    else:
-        msg["To"] = ",".join(recipients)
+        recipients = [recipients]
+    msg["To"] = ",".join(recipients)
 
     try:
-        with smtplib.SMTP(
-            current_app.config["RECEIPTS_SMTP_HOST"],
-            port=current_app.config["RECEIPTS_SMTP_PORT"],
-        ) as s:
-            s.starttls()
-            s.login(
-                current_app.config["RECEIPTS_SMTP_USERNAME"],
-                current_app.config["RECEIPTS_SMTP_PASSWORD"],
-            )
-            s.send_message(msg, to_addrs=recipients)
+        if session is not None:
+            session.send(msg, recipients)
+        else:
+            with SMTPSession.from_config(current_app.config) as s:
+                s.send(msg, recipients)
     except smtplib.SMTPException as ex:
         current_app.logger.error(f"Failed to send email: {type(ex).__name__}: {ex}")
         raise
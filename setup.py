@@ -3,7 +3,7 @@ from setuptools import find_packages, setup
 setup(
     name="receipt_helper",
     version="0.0.1",
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
     include_package_data=True,
     zip_safe=True,
     install_requires=[
@@ -26,7 +26,10 @@ setup(
         "mypy-extensions==1.0.0",
         "packaging==24.0",
         "pathspec==0.12.1",
+        "pillow==10.2.0",
         "platformdirs==4.2.0",
+        "prometheus_client==0.20.0",
+        "pypdf==4.0.1",
         "setuptools==69.1.1",
         "SQLAlchemy==2.0.28",
         "typing_extensions==4.10.0",
@@ -0,0 +1,96 @@
+import datetime
+
+import pytest
+from sqlalchemy import event
+
+from receipt_helper import create_app, db
+from receipt_helper.enums import ClearanceEnum, ReceiptStatusEnum
+from receipt_helper.model.receipt import File, Receipt
+from receipt_helper.model.user import User
+
+RECEIPTS = 1000
+SUBMITTERS = 100
+# The change counter and the receipts, with their submitter, status and file
+# joined in, plus some slack. Lazy loads would add a query per submitter.
+MAX_QUERIES = 5
+
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    data = tmp_path_factory.mktemp("data")
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("SECRET_KEY", "test")
+        mp.setenv("SQLALCHEMY_DATABASE_URI", f"sqlite:///{data / 'db.sqlite'}")
+        mp.setenv("RECEIPTS_STORAGE_PATH", str(data / "receipts"))
+        mp.setenv("RECEIPTS_EMAIL_WORKER", "none")
+        mp.setenv("RECEIPTS_PAGE_SIZE", str(RECEIPTS))
+        app = create_app()
+    app.config.update(TESTING=True)
+
+    statuses = list(ReceiptStatusEnum)
+    with app.app_context():
+        cfo = User(
+            email="cfo@example.com",
+            name="CFO",
+            password="x",
+            needs_password_change=False,
+            userTypeId=(ClearanceEnum.User | ClearanceEnum.CFO).value,
+        )
+        submitters = [
+            User(email=f"user{i}@example.com", name=f"User {i}", password="x")
+            for i in range(SUBMITTERS)
+        ]
+        db.session.add_all([cfo, *submitters])
+        db.session.flush()
+        db.session.add_all(
+            Receipt(
+                userId=(cfo if i % 2 else submitters[i % SUBMITTERS]).id,
+                receipt_date=datetime.datetime(2024, 1, 1)
+                + datetime.timedelta(days=i % 300),
+                submit_date=datetime.datetime(2024, 2, 1)
+                + datetime.timedelta(days=i % 200),
+                activity=f"Aktivitet {i % 20}",
+                amount=100 * i,
+                statusId=statuses[i % len(statuses)].value,
+                file=File(path=str(data), filename=f"receipt_{i}.png"),
+            )
+            for i in range(RECEIPTS)
+        )
+        db.session.commit()
+        app.config["TEST_CFO_ID"] = cfo.id
+    return app
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = app.config["TEST_CFO_ID"]
+    return client
+
+
+def count_queries(app, client, url: str) -> int:
+    queries = []
+
+    def count(*args):
+        queries.append(args[2])
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", count)
+    try:
+        response = client.get(url)
+    finally:
+        with app.app_context():
+            event.remove(db.engine, "before_cursor_execute", count)
+    assert response.status_code == 200
+    return len(queries)
+
+
+@pytest.mark.parametrize(
+    "url, rows",
+    [("/cfo/view_receipts", RECEIPTS), ("/", RECEIPTS // 2)],
+)
+def test_receipt_list_queries(app, client, url, rows):
+    response = client.get(url)
+    assert response.get_data(as_text=True).count("Kvittodatum:") == rows
+    assert count_queries(app, client, url) <= MAX_QUERIES